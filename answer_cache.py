@@ -0,0 +1,134 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from config import ANSWER_CACHE_DB_PATH, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ITEMS
+
+
+class AnswerCache:
+    """
+    Vision-LLM answers reused for near-duplicate questions. An entry matches when the new
+    question retrieved the same set of pages (with the same model and chat context) and
+    its embedding has cosine similarity >= `threshold` with the cached question.
+    Entries live in SQLite; the in-memory copy reloads whenever another connection
+    (e.g. ingestion invalidating pages) changes the database.
+    """
+
+    def __init__(self, db_path=ANSWER_CACHE_DB_PATH, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 max_items: int = ANSWER_CACHE_MAX_ITEMS):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._data_version = None
+        self._ids = np.empty(0, dtype="int64")
+        self._signatures = np.empty(0, dtype=object)
+        self._embeddings = np.empty((0, 0), dtype="float32")
+        self._pages = []
+        self._answers = []
+
+    def _conn(self):
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY, signature TEXT, pages TEXT, embedding BLOB, answer TEXT, created REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _refresh(self):
+        db = self._conn()
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        rows = db.execute("SELECT id, signature, pages, embedding, answer FROM answers ORDER BY id").fetchall()
+        self._ids = np.array([r[0] for r in rows], dtype="int64")
+        self._signatures = np.array([r[1] for r in rows], dtype=object)
+        self._pages = [set(json.loads(r[2])) for r in rows]
+        self._embeddings = (np.stack([np.frombuffer(r[3], dtype="float32") for r in rows])
+                            if rows else np.empty((0, 0), dtype="float32"))
+        self._answers = [r[4] for r in rows]
+        self._data_version = version
+
+    @staticmethod
+    def signature(pages, model: str, context: str = "") -> str:
+        names = sorted(Path(p).name for p in pages)
+        return hashlib.sha256(json.dumps([model, names, context]).encode()).hexdigest()
+
+    @staticmethod
+    def _unit(embedding):
+        embedding = np.asarray(embedding, dtype="float32").ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def lookup(self, query_embedding, pages, model: str, context: str = ""):
+        query = self._unit(query_embedding)
+        signature = self.signature(pages, model, context)
+        with self._lock:
+            self._refresh()
+            if len(self._ids) and self._embeddings.shape[1] == len(query):
+                sims = self._embeddings @ query
+                sims[self._signatures != signature] = -np.inf
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    self.hits += 1
+                    return self._answers[best]
+            self.misses += 1
+            return None
+
+    def store(self, query_embedding, pages, model: str, answer: str, context: str = ""):
+        query = self._unit(query_embedding)
+        names = sorted(Path(p).name for p in pages)
+        signature = self.signature(pages, model, context)
+        with self._lock:
+            self._refresh()
+            db = self._conn()
+            row_id = db.execute(
+                "INSERT INTO answers (signature, pages, embedding, answer, created) VALUES (?, ?, ?, ?, ?)",
+                (signature, json.dumps(names), query.tobytes(), answer, time.time())).lastrowid
+            db.execute("DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                       (self.max_items,))
+            db.commit()
+            # data_version only tracks other connections' writes: mirror ours in memory
+            if not len(self._ids):
+                self._embeddings = np.empty((0, len(query)), dtype="float32")
+            elif self._embeddings.shape[1] != len(query):
+                self._data_version = None  # another embedding size: reload on the next lookup
+                return
+            self._ids = np.append(self._ids, row_id)
+            self._signatures = np.append(self._signatures, np.array([signature], dtype=object))
+            self._embeddings = np.vstack([self._embeddings, query])
+            self._pages.append(set(names))
+            self._answers.append(answer)
+            self._keep(np.arange(len(self._ids)) >= len(self._ids) - self.max_items)
+
+    def _keep(self, mask):
+        self._ids = self._ids[mask]
+        self._signatures = self._signatures[mask]
+        self._embeddings = self._embeddings[mask]
+        self._pages = [pages for pages, keep in zip(self._pages, mask) if keep]
+        self._answers = [answer for answer, keep in zip(self._answers, mask) if keep]
+
+    def invalidate_pages(self, page_names) -> int:
+        """Drops every cached answer that was produced from any of the given pages."""
+        page_names = {Path(p).name for p in page_names}
+        with self._lock:
+            self._refresh()
+            stale = np.array([bool(pages & page_names) for pages in self._pages], dtype=bool)
+            if stale.any():
+                db = self._conn()
+                db.executemany("DELETE FROM answers WHERE id = ?", [(int(i),) for i in self._ids[stale]])
+                db.commit()
+                self._keep(~stale)
+            return int(stale.sum())
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._ids)}
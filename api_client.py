@@ -0,0 +1,32 @@
+import json
+import codecs
+import urllib.request
+from config import RAG_API_URL
+from resilience import rag_api_endpoint
+
+
+def _post(path: str, payload: dict, timeout: float = 120):
+    request = urllib.request.Request(
+        f"{RAG_API_URL.rstrip('/')}{path}",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    return rag_api_endpoint.call(urllib.request.urlopen, request, timeout=timeout)
+
+
+def search_image_by_question(question, co=None, top_k=4, filters: dict = None):
+    """Same contract as vision_query.search_image_by_question, served by api_server."""
+    with _post("/search", {"question": question, "top_k": top_k, "filters": filters}) as response:
+        return json.load(response)["images"]
+
+
+def stream_answer_about_images(question: str, matched_paths: list, client=None, context_cache: list = None,
+                               **kwargs):
+    """Same contract as vision_query.stream_answer_about_images, served by api_server."""
+    context = [{"question": c["question"], "answer": c["answer"]} for c in context_cache or []]
+    payload = {"question": question, "images": matched_paths, "context": context}
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with _post("/answer/stream", payload) as response:
+        while chunk := response.read1(4096):
+            if text := decoder.decode(chunk):
+                yield text
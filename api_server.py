@@ -0,0 +1,136 @@
+"""
+Headless query service over the same retrieval and generation code as the Streamlit app.
+
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+
+One process holds one in-memory FAISS index and one pooled Cohere/OpenAI client pair.
+Concurrent identical requests are coalesced into a single upstream call.
+"""
+import json
+import asyncio
+from pathlib import Path
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+from config import get_cohere_client, get_openai_client, API_WORKER_THREADS, IMG_FOLDER, TILE_FOLDER
+from faiss_utils import get_faiss_index
+from page_dedup import get_aliases
+from tiles import load_tile_meta
+from tracing import render_prometheus
+from query_cache import normalize_question
+from embeddings import get_query_embedding
+from vision_query import search_image_by_question, answer_question_about_images, stream_answer_about_images
+
+@asynccontextmanager
+async def lifespan(app):
+    # Blocking SDK calls run on this pool; size it for the expected concurrency
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=API_WORKER_THREADS))
+    get_faiss_index()  # load the index and build the clients before the first request
+    get_cohere_client()
+    get_openai_client()
+    yield
+
+
+app = FastAPI(title="Multimodal RAG", lifespan=lifespan)
+
+_in_flight = {}  # request key -> asyncio.Future shared by identical concurrent requests
+
+
+class SearchRequest(BaseModel):
+    question: str
+    top_k: int = 4
+    filters: dict | None = None  # {"documents", "years", "pages"}, see page_meta
+
+
+class AnswerRequest(BaseModel):
+    question: str
+    images: list[str] | None = None  # pages from a previous /search; searched here if omitted
+    context: list[dict] = []  # recent {"question", "answer"} turns
+    top_k: int = 4
+    filters: dict | None = None
+
+
+async def _coalesced(key, fn, *args):
+    """Runs fn(*args) in a worker thread, sharing the result with identical in-flight requests."""
+    future = _in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+        _in_flight[key] = future
+        future.add_done_callback(lambda _: _in_flight.pop(key, None))
+    return await asyncio.shield(future)
+
+
+async def _search(question: str, top_k: int, filters: dict = None) -> list:
+    key = ("search", normalize_question(question), top_k, json.dumps(filters, sort_keys=True))
+    return await _coalesced(key, search_image_by_question, question, get_cohere_client(), top_k, filters)
+
+
+def _is_indexed_image(path: str) -> bool:
+    """True for a page or tile image that a search can return; anything else is refused."""
+    resolved = Path(path).resolve()
+    if resolved.parent == IMG_FOLDER.resolve():
+        index, filenames = get_faiss_index()
+        return resolved.name in get_aliases() or resolved.name in filenames
+    if resolved.parent == TILE_FOLDER.resolve():
+        return resolved.name in load_tile_meta()
+    return False
+
+
+async def _answer_images(req: AnswerRequest) -> list:
+    """The request's pages, searched when omitted; client-supplied paths must be indexed images."""
+    try:
+        if req.images is None:
+            return await _search(req.question, req.top_k, req.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    refused = [path for path in req.images if not _is_indexed_image(path)]
+    if refused:
+        raise HTTPException(status_code=422, detail=f"Not indexed page images: {refused}")
+    return req.images
+
+
+@app.get("/health")
+async def health():
+    index, filenames = get_faiss_index()
+    return {"status": "ok", "pages": index.ntotal}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage latency percentiles in Prometheus text format."""
+    return render_prometheus()
+
+
+@app.post("/search")
+async def search(req: SearchRequest):
+    try:
+        return {"images": await _search(req.question, req.top_k, req.filters)}
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/answer")
+async def answer(req: AnswerRequest):
+    images = await _answer_images(req)
+    query_embedding = await asyncio.to_thread(get_query_embedding, req.question, get_cohere_client())
+    key = ("answer", normalize_question(req.question), tuple(images), json.dumps(req.context, sort_keys=True))
+    text = await _coalesced(key, lambda: answer_question_about_images(
+        question=req.question, matched_paths=images, client=get_openai_client(), verbose=False,
+        context_cache=req.context, query_embedding=query_embedding,
+    ))
+    return {"answer": text, "images": images}
+
+
+@app.post("/answer/stream")
+async def answer_stream(req: AnswerRequest):
+    """Plain-text stream of answer tokens; pass the pages from /search in `images`."""
+    images = await _answer_images(req)
+    query_embedding = await asyncio.to_thread(get_query_embedding, req.question, get_cohere_client())
+    # A sync generator: Starlette iterates it in a worker thread
+    tokens = stream_answer_about_images(
+        question=req.question, matched_paths=images, client=get_openai_client(), verbose=False,
+        context_cache=req.context, query_embedding=query_embedding,
+    )
+    return StreamingResponse(tokens, media_type="text/plain; charset=utf-8")
@@ -3,32 +3,33 @@ import traceback
 import shutil
 import base64
 import time
-import cohere
 import tempfile
 import mimetypes
 from pathlib import Path
 import streamlit as st
-from openai import OpenAI
-from dotenv import load_dotenv
-from utils import load_json, hash_file, save_json
+from utils import load_json, hash_file
 import streamlit.components.v1 as components
-from pdf_processing_embedding import process_pdfs_and_embed_pages
-from vision_query import search_image_by_question, answer_question_about_images
-from chat_history import generate_session_id, save_chat_history, load_chat_history, CHAT_DATA_DIR
-from config import HASHES_FOLDER, PDF_HASH_FILE, PDF_FOLDER, IMG_FOLDER, co
+from config import RAG_API_URL
+if RAG_API_URL:
+    # Thin client: retrieval and generation run in api_server.py
+    from api_client import search_image_by_question, stream_answer_about_images
+else:
+    from vision_query import search_image_by_question, stream_answer_about_images
+from embeddings import get_query_embedding
+from image_prep import make_thumbnail, prepare_image, static_url
+from page_meta import document_year
+from tracing import summary as trace_summary
+from chat_history import generate_session_id, append_chat_turn, load_chat_history, list_chat_sessions
+from config import HASHES_FOLDER, PDF_HASH_FILE, PDF_FOLDER, ensure_folders, get_cohere_client, get_openai_client
+from config import INGEST_AUTOSTART, INGEST_POLL_SECONDS
+from ingest_worker import JobQueue, ensure_worker, eta
 
 # Ensure paths exist
-HASHES_FOLDER.mkdir(parents=True, exist_ok=True)
-PDF_FOLDER.parent.mkdir(parents=True, exist_ok=True)
-IMG_FOLDER.parent.mkdir(parents=True, exist_ok=True)
-
-
-load_dotenv()
-co = cohere.ClientV2(api_key=os.getenv("COHERE_API_KEY"))
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+ensure_folders()
 
 pdf_hash_path = os.path.join(HASHES_FOLDER, PDF_HASH_FILE)
 file_hashes = load_json(pdf_hash_path)
+job_queue = JobQueue()
 
 
 # Initialize or restore session
@@ -40,10 +41,8 @@ if "context_cache" not in st.session_state:
 if "chat_id" not in st.session_state:
     st.session_state.chat_id = generate_session_id()
 
-current_chat_path = CHAT_DATA_DIR / f"{st.session_state.chat_id}.json"
-
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = load_chat_history(current_chat_path)
+    st.session_state.chat_history = load_chat_history(st.session_state.chat_id)
 
 # UI
 st.set_page_config("Multimodal RAG")
@@ -98,7 +97,19 @@ st.sidebar.markdown(
 # Hide default label
 uploaded_file = st.sidebar.file_uploader("Upload PDF", type="pdf", label_visibility="collapsed")
 
-if uploaded_file:
+# Each upload is queued once; a rerun (e.g. after its job failed) must not queue it again
+queued_uploads = st.session_state.setdefault("queued_uploads", {})  # uploader file_id -> job id
+
+if uploaded_file and uploaded_file.file_id in queued_uploads:
+    upload_job = job_queue.job(queued_uploads[uploaded_file.file_id])
+    if upload_job is not None and upload_job["status"] == "failed":
+        st.sidebar.error(f"❌ Ingestion of {uploaded_file.name} failed: {upload_job['error']}")
+    elif upload_job is not None and upload_job["status"] == "done":
+        st.sidebar.success("✅ Already processed.")
+    else:
+        st.sidebar.info("📥 Queued for ingestion.")
+
+elif uploaded_file:
     try:
         # ✅ Save uploaded file to a temp location
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
@@ -114,24 +125,26 @@ if uploaded_file:
             file_stem = Path(filename).stem
             file_hash = hash_file(temp_path)
 
+            active_job = job_queue.active_job(file_stem)
             if file_hashes.get(file_stem) == file_hash:
                 st.sidebar.success("✅ Already processed.")
                 temp_path.unlink(missing_ok=True)
+            elif active_job is not None and active_job["sha256"] == file_hash:
+                queued_uploads[uploaded_file.file_id] = active_job["id"]
+                st.sidebar.info("📥 Queued for ingestion.")
+            elif active_job is not None:
+                st.sidebar.warning(f"⏳ An earlier version of {filename} is still being ingested; "
+                                   f"upload this one when it finishes.")
             else:
-                st.sidebar.info("🔄 Processing...")
-
                 # ✅ Move to final path
                 final_path = PDF_FOLDER / filename
                 shutil.move(str(temp_path), str(final_path))
 
-                # ✅ Process PDF
-                process_pdfs_and_embed_pages(co, specific_pdf_path=final_path)
-
-                # ✅ Save hash
-                file_hashes[file_stem] = file_hash
-                save_json(pdf_hash_path, file_hashes)
-
-                st.sidebar.success("✅ File processed.")
+                # ✅ Queue it: the ingestion worker embeds it and publishes a new index generation
+                queued_uploads[uploaded_file.file_id] = job_queue.enqueue(final_path, file_hash)
+                if INGEST_AUTOSTART:
+                    ensure_worker(job_queue)
+                st.sidebar.info("📥 Queued for ingestion.")
 
     except Exception as e:
         st.sidebar.error(f"❌ Failed: {e}")
@@ -251,6 +264,48 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# 📥 Ingestion progress, polled while jobs are queued or running
+def _format_eta(seconds):
+    return f"{seconds / 60:.0f} min" if seconds >= 90 else f"{seconds:.0f} s"
+
+
+@st.fragment(run_every=INGEST_POLL_SECONDS if job_queue.has_active() else None)
+def ingestion_progress():
+    jobs = job_queue.recent(limit=5)
+    for job in jobs:
+        name = job["document"]
+        if job["status"] == "running" and job["pages_total"]:
+            done, total = job["pages_done"], job["pages_total"]
+            remaining = eta(job)
+            text = f"🔄 {name}: {done}/{total} pages" + (f" · ETA {_format_eta(remaining)}" if remaining else "")
+            st.progress(min(done / total, 1.0), text=text)
+        elif job["status"] == "merging":
+            st.progress(1.0, text=f"🧮 {name}: merging into the index")
+        elif job["status"] in ("queued", "running"):
+            st.caption(f"⏳ {name}: queued")
+        elif job["status"] == "done":
+            st.caption(f"✅ {name}: published (index generation {job['generation']})")
+        else:
+            st.caption(f"❌ {name}: {job['error']}")
+    # Once the last job finishes, rerun the whole app so new documents show up in the filters
+    active = any(job["status"] in ("queued", "running", "merging") for job in jobs)
+    # A worker that died (OOM, host restart) leaves its jobs running: a new one requeues them
+    if active and INGEST_AUTOSTART:
+        ensure_worker(job_queue)
+    if st.session_state.get("ingesting") and not active:
+        st.session_state.ingesting = False
+        st.rerun(scope="app")
+    st.session_state.ingesting = active
+
+
+with st.sidebar:
+    ingestion_progress()
+
+# 📅 Restrict answers to some report years (the search runs only over their pages)
+report_years = sorted({document_year(name) for name in file_hashes} - {0}, reverse=True)
+selected_years = st.sidebar.multiselect("📅 Report years", report_years, placeholder="All years")
+search_filters = {"years": selected_years} if selected_years else None
+
 # Button handler
 if question and st.button("💬 Get Answer"):
     with st.container():
@@ -259,27 +314,44 @@ if question and st.button("💬 Get Answer"):
         spinner_slot.markdown(spinner_html, unsafe_allow_html=True)
 
         try:
-            img_paths = search_image_by_question(question, co)
+            # Clients are built on the first question; the thin client needs none
+            co = None if RAG_API_URL else get_cohere_client()
+            client = None if RAG_API_URL else get_openai_client()
+            img_paths = search_image_by_question(question, co, filters=search_filters)
 
             # ✅ Ensure it's a list
             if not isinstance(img_paths, list):
                 raise TypeError(f"Expected list of image paths, got: {type(img_paths)} → {img_paths}")
 
-            answer = answer_question_about_images(
+            answer_stream = stream_answer_about_images(
                         question=question,
                         matched_paths=img_paths,
                         client=client,
-                        context_cache=st.session_state.context_cache  # ✅ new context param
+                        context_cache=st.session_state.context_cache,  # ✅ new context param
+                        # ✅ cached by the search above; the API server embeds on its own side
+                        query_embedding=None if RAG_API_URL else get_query_embedding(question, co)
                     )
 
+            # ✅ Keep the spinner until the first token arrives, then render partial output
+            def tokens_after_spinner():
+                for i, token in enumerate(answer_stream):
+                    if i == 0:
+                        spinner_slot.empty()
+                    yield token
 
-            # Store to session
-            st.session_state.chat_history.append({
+            answer_slot = st.empty()
+            with answer_slot.container():
+                answer = st.write_stream(tokens_after_spinner()).strip()
+            answer_slot.empty()  # the finished answer is shown in the chat box below
+
+            # Store to session, then append just this turn to the chat store
+            turn = {
                 "question": question,
                 "answer": answer,
                 "images": img_paths
-            })
-            save_chat_history(st.session_state.chat_history, current_chat_path)
+            }
+            st.session_state.chat_history.append(turn)
+            append_chat_turn(st.session_state.chat_id, turn)
             
             # Update sliding context cache (keep last 3–4)
             st.session_state.context_cache.append({
@@ -298,18 +370,39 @@ if question and st.button("💬 Get Answer"):
 
 
 if st.sidebar.button("🆕 Start New Chat"):
-    # Save current chat before resetting
-    if st.session_state.get("chat_history"):
-        old_path = CHAT_DATA_DIR / f"{st.session_state.chat_id}.json"
-        save_chat_history(st.session_state.chat_history, old_path)
-
-    # Reset session
+    # Every turn is already persisted as it happens; just reset the session
     st.session_state.chat_id = generate_session_id()
     st.session_state.chat_history = []
     st.session_state.context_cache = []  # ✅ Clear cache
 
     st.rerun()
 
+# ⏱️ Debug panel: latency percentiles per pipeline stage in this process
+with st.sidebar.expander("⏱️ Stage latency"):
+    stage_stats = trace_summary()
+    if stage_stats:
+        st.dataframe(
+            [{"stage": stage, "count": s["count"], **{q: f"{s[q] * 1000:.0f} ms" for q in ("p50", "p95", "p99")}}
+             for stage, s in stage_stats.items()],
+            hide_index=True,
+        )
+    else:
+        st.caption("No timings recorded yet.")
+
+# 🗂️ Past chats, most recent first (served from the indexed chat store)
+st.sidebar.markdown(
+    "<h3 style='color: #000840; font-weight: bold;'>🗂️ Past Chats</h3>",
+    unsafe_allow_html=True
+)
+for session in list_chat_sessions(limit=10):
+    label = f"{session['title']} ({session['turns']})"
+    if st.sidebar.button(label, key=f"open_{session['session_id']}", disabled=session["session_id"] == st.session_state.chat_id):
+        st.session_state.chat_id = session["session_id"]
+        st.session_state.chat_history = load_chat_history(session["session_id"])
+        st.session_state.context_cache = st.session_state.chat_history[-4:]
+        st.rerun()
+
+@st.cache_data
 def get_image_base64(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode()
@@ -369,24 +462,25 @@ chat_html = """
         <div class="scroll-box">
 """
 
-# Build chat HTML
-for pair in reversed(st.session_state.chat_history):
-    # User message (right-aligned)
-    chat_html += f"""
+# Rendered HTML is memoized per chat turn, so a rerun only renders the new turn
+@st.cache_data(max_entries=2000)
+def render_chat_turn(question, answer):
+    # User message (right-aligned), then bot message (left-aligned)
+    return f"""
     <div class="chat-message user">
-        <div class="bubble">{pair['question']}</div>
+        <div class="bubble">{question}</div>
         <img class="avatar" src="data:image/png;base64,{user_icon}" />
     </div>
-    """
-
-    # Bot message (left-aligned)
-    chat_html += f"""
     <div class="chat-message bot">
         <img class="avatar" src="data:image/png;base64,{bot_icon}" />
-        <div class="bubble">{pair['answer']}</div>
+        <div class="bubble">{answer}</div>
     </div>
     """
 
+# Build chat HTML
+for pair in reversed(st.session_state.chat_history):
+    chat_html += render_chat_turn(pair['question'], pair['answer'])
+
 # Render chat using components (this respects scrolling)
 components.html(chat_html + "</div>", height=520, scrolling=False)
 
@@ -502,27 +596,37 @@ image_html = """
         <div class="image-scroll-box">
 """
 
-# Build image grid HTML
-for idx, pair in enumerate(reversed(st.session_state.chat_history)):
-    if pair.get("images"):
-        image_html += f"""
+# Thumbnails are lazy-loaded static files; the full page is only fetched when the modal opens.
+# Only the HTML is cached: pages and derivatives are checked on every run, since the
+# ingestion worker may write them after a question was first shown.
+def render_image_block(q_number, question, img_paths):
+    cards = tuple(
+        (os.path.basename(img_path), static_url(make_thumbnail(img_path)), static_url(prepare_image(img_path)))
+        for img_path in img_paths if os.path.exists(img_path)
+    )
+    return _image_block_html(q_number, question, cards)
+
+
+@st.cache_data(max_entries=2000)
+def _image_block_html(q_number, question, cards):
+    block = f"""
         <div class="image-block">
-            <div class="image-title">🔹 Q{len(st.session_state.chat_history)-idx}: {pair['question']}</div>
+            <div class="image-title">🔹 Q{q_number}: {question}</div>
             <div class="image-grid">
         """
-        for img_path in pair["images"]:
-            if os.path.exists(img_path):
-                img_name = os.path.basename(img_path)
-                with open(img_path, "rb") as img_file:
-                    img_base64 = base64.b64encode(img_file.read()).decode()
-                    image_html += f"""
+    for img_name, thumb_url, full_url in cards:
+        block += f"""
                     <div class="image-card">
-                        <img src="data:image/png;base64,{img_base64}" onclick="openModal(this.src)">
+                        <img src="{thumb_url}" data-full="{full_url}" loading="lazy" onclick="openModal(this.dataset.full)">
                         <div class="image-name">{img_name}</div>
                     </div>
                     """
+    return block + "</div></div>"
 
-        image_html += "</div></div>"
+# Build image grid HTML
+for idx, pair in enumerate(reversed(st.session_state.chat_history)):
+    if pair.get("images"):
+        image_html += render_image_block(len(st.session_state.chat_history) - idx, pair['question'], tuple(pair["images"]))
 
 image_html += "</div>"
 
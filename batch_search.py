@@ -0,0 +1,51 @@
+"""
+Search many questions at once, e.g. for offline evaluation or FAQ pre-answering.
+
+    python batch_search.py questions.txt --out results.jsonl --top-k 4
+    python batch_search.py questions.txt --year 2023 --pages 1 40
+
+Reads one question per line and streams one JSON result per line, so arbitrarily
+large question files are processed in constant memory.
+"""
+import sys
+import json
+import time
+import argparse
+from config import get_cohere_client, QUERY_BATCH_SIZE
+from vision_query import search_images_by_questions
+
+
+def _read_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions")
+    parser.add_argument("--out", help="JSONL output file (default: stdout)")
+    parser.add_argument("--top-k", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=QUERY_BATCH_SIZE)
+    parser.add_argument("--document", action="append", help="only this report (repeatable)")
+    parser.add_argument("--year", type=int, action="append", help="only reports of this year (repeatable)")
+    parser.add_argument("--pages", type=int, nargs=2, metavar=("FIRST", "LAST"), help="only this page range")
+    args = parser.parse_args()
+    filters = {"documents": args.document, "years": args.year, "pages": args.pages}
+    filters = {key: value for key, value in filters.items() if value}
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    start = time.perf_counter()
+    count = 0
+    try:
+        for result in search_images_by_questions(_read_questions(args.questions), get_cohere_client(), args.top_k,
+                                                 args.batch_size, filters):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Searched {count} questions in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f} q/s)", file=sys.stderr)
@@ -0,0 +1,183 @@
+"""
+Offline benchmarks with fake Cohere/OpenAI clients; no API keys or network needed.
+
+    python benchmark.py ingest  [--latency 0.3]                   # ingest source_docs/ into a scratch store
+    python benchmark.py query   [--queries 200 --concurrency 8]   # search + answer against store/ and images/
+    python benchmark.py search  [--queries 1000]                  # retrieval only
+    python benchmark.py imports [--top 15]                        # cold import time of the entry modules
+
+Every run works in a temporary directory (the real store/ and images/ are linked
+read-only), so caches and outputs never touch the working tree. Results are
+printed as JSON: throughput, latency percentiles, peak RSS and per-stage timings.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import contextlib
+import tempfile
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = Path(__file__).resolve().parent
+ENTRY_MODULES = ["config", "utils", "vision_query", "chat_history", "pdf_processing_embedding", "api_server"]
+
+os.environ.setdefault("COHERE_API_KEY", "offline-benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+
+def _workspace(link_store: bool) -> Path:
+    """Scratch working directory; config paths are relative, so they resolve inside it."""
+    workspace = Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    (workspace / "store").mkdir()
+    (workspace / "source_docs").symlink_to(REPO / "source_docs")
+    if link_store:
+        (workspace / "images").symlink_to(REPO / "images")
+        # Index generations and the manifest; new generations replace the links, not the files
+        for path in (REPO / "store").iterdir():
+            if path.is_file() and not path.name.startswith(("cache.sqlite", "answers.sqlite")):
+                (workspace / "store" / path.name).symlink_to(path)
+    os.chdir(workspace)
+    return workspace
+
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _latency_stats(latencies) -> dict:
+    latencies = np.asarray(latencies) * 1000
+    if not len(latencies):
+        return {}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"count": len(latencies), "mean_ms": latencies.mean(), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+def _questions(n: int) -> list:
+    """Real questions from the saved chats, made unique so caches do not hide the work."""
+    base = []
+    for path in sorted((REPO / "chat_data").glob("*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            base += [turn["question"] for turn in json.load(f)]
+    base = base or ["What did the trust funds finance?"]
+    return [f"{base[i % len(base)]} (#{i})" for i in range(n)]
+
+
+def bench_ingest(args, co, client) -> dict:
+    from pdf_processing_embedding import process_pdfs_and_embed_pages
+    start = time.perf_counter()
+    process_pdfs_and_embed_pages(co)
+    elapsed = time.perf_counter() - start
+    pages = len(list(Path("images").glob("*.png")))
+    return {"pages": pages, "seconds": elapsed, "pages_per_second": pages / elapsed if elapsed else None,
+            "embed_calls": co.calls}
+
+
+def _import_times(module: str) -> list:
+    """(cumulative_us, self_us, name) per module from `python -X importtime -c "import <module>"`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), int(own), name.strip()))
+    return rows
+
+
+def bench_imports(args) -> dict:
+    """Cold-start cost of each entry module in a fresh interpreter, with its heaviest imports."""
+    report = {}
+    for module in ENTRY_MODULES:
+        rows = _import_times(module)
+        total = next((c for c, _, name in rows if name == module), 0)
+        heaviest = sorted((r for r in rows if r[2] != module), reverse=True)[:args.top]
+        report[module] = {"ms": total / 1000,
+                          "heaviest": {name: cumulative / 1000 for cumulative, _, name in heaviest}}
+    return {"workload": "imports", "modules": report}
+
+
+def bench_query(args, co, client, answer: bool) -> dict:
+    from vision_query import search_image_by_question, answer_question_about_images
+    from embeddings import get_query_embedding
+
+    def run(question):
+        start = time.perf_counter()
+        paths = search_image_by_question(question, co)
+        if answer:
+            answer_question_about_images(question, paths, client, verbose=False,
+                                         query_embedding=get_query_embedding(question, co))
+        return time.perf_counter() - start
+
+    questions = _questions(args.queries)
+    run(questions[0])  # warm up: loads the index and opens the caches
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(run, questions[1:]))
+    elapsed = time.perf_counter() - start
+    return {"queries": len(latencies), "concurrency": args.concurrency, "seconds": elapsed,
+            "queries_per_second": len(latencies) / elapsed, "latency": _latency_stats(latencies),
+            "embed_calls": co.calls, "llm_calls": client.calls}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workload", choices=["ingest", "query", "search", "imports"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Cohere latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=1.5, help="fake OpenAI latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports listed per module")
+    parser.add_argument("--out", help="also write the JSON report here")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch workspace")
+    args = parser.parse_args()
+
+    out_path = Path(args.out).resolve() if args.out else None
+    if args.workload == "imports":
+        text = json.dumps(bench_imports(args), indent=2)
+        print(text)
+        if out_path:
+            out_path.write_text(text)
+        sys.exit()
+
+    sys.path.insert(0, str(REPO))
+    workspace = _workspace(link_store=args.workload != "ingest")
+
+    import tracing
+    from resilience import endpoint_stats
+    from fake_clients import FakeCohere, FakeOpenAI
+    co = FakeCohere(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+    client = FakeOpenAI(latency=args.llm_latency, jitter=args.jitter, error_rate=args.error_rate, seed=args.seed)
+
+    try:
+        # Progress prints from the pipeline go to stderr so stdout stays valid JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.workload == "ingest":
+                report = bench_ingest(args, co, client)
+            else:
+                report = bench_query(args, co, client, answer=args.workload == "query")
+        report = {"workload": args.workload, **report, "peak_rss_mb": _peak_rss_mb(),
+                  "endpoints": endpoint_stats(), "stages": tracing.summary()}
+    finally:
+        os.chdir(REPO)
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, default=float)
+    print(text)
+    if out_path:
+        out_path.write_text(text)
@@ -0,0 +1,100 @@
+"""
+Rebuild the search index from the stored page vectors, or benchmark index types.
+
+    python build_index.py                 # rebuild using INDEX_TYPE from config
+    python build_index.py --type hnsw     # rebuild as HNSW
+    python build_index.py --storage int8  # rebuild with scalar-quantized vectors
+    python build_index.py --search-dim 256  # rebuild as a truncated Matryoshka coarse index
+    python build_index.py --benchmark     # recall@k, latency and size vs. the exact Flat index
+"""
+import time
+import argparse
+import faiss
+import numpy as np
+from config import INDEX_TYPE, INDEX_STORAGE, SEARCH_DIM
+from faiss_utils import (load_manifest, load_vectors, load_filenames, create_index, set_search_params,
+                         search_index, publish_generation)
+
+
+def rebuild(index_type: str, storage: str, search_dim: int):
+    manifest = load_manifest()
+    vectors = load_vectors(manifest)
+    index = create_index(vectors, index_type, storage, search_dim)
+    manifest = publish_generation(vectors, load_filenames(manifest), index, storage)
+    print(f"✅ Rebuilt {index_type}/{storage} {index.d}-d index with {index.ntotal} vectors "
+          f"→ generation {manifest['generation']} ({manifest['files']['index']})")
+
+
+def _timed_search(index, queries, k, vectors):
+    start = time.perf_counter()
+    _, ids = search_index(index, queries, k, vectors=vectors)
+    return ids, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def _index_mb(index):
+    if isinstance(index, faiss.IndexBinary):
+        return len(faiss.serialize_index_binary(index)) / 2**20
+    return len(faiss.serialize_index(index)) / 2**20
+
+
+def benchmark(k: int, n_queries: int, seed: int = 0):
+    vectors = load_vectors()
+    if not len(vectors):
+        print("❌ No vectors stored yet; ingest some PDFs first.")
+        return
+
+    # Queries are stored pages with noise added, so no embedding calls are needed
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), n_queries)]
+    queries = queries + rng.normal(scale=0.02, size=queries.shape).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    flat = create_index(vectors, "flat")
+    exact_ids, flat_ms = _timed_search(flat, queries, k, vectors)
+    print(f"{'index':<30}{'recall@' + str(k):>10}{'ms/query':>12}{'index MB':>10}")
+    print(f"{'flat/float (exact)':<30}{1.0:>10.3f}{flat_ms:>12.3f}{_index_mb(flat):>10.2f}")
+
+    candidates = [("flat", None, [None]),
+                  ("hnsw", "efSearch", [16, 32, 64, 128, 256]),
+                  ("ivf", "nprobe", [1, 2, 4, 8, 16, 32])]
+    for storage in ("float", "int8", "binary"):
+        for index_type, param, values in candidates:
+            if index_type == "flat" and storage == "float":
+                continue
+            index = create_index(vectors, index_type, storage)
+            for value in values:
+                if param == "efSearch":
+                    set_search_params(index, ef_search=value)
+                elif param == "nprobe":
+                    set_search_params(index, nprobe=value)
+                ids, ms = _timed_search(index, queries, k, vectors)
+                recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)])
+                label = f"{index_type}/{storage}" + (f" {param}={value}" if param else "")
+                print(f"{label:<30}{recall:>10.3f}{ms:>12.3f}{_index_mb(index):>10.2f}")
+
+    # Matryoshka coarse search over truncated vectors, re-ranked at full dimension
+    for search_dim in (256, 512, 1024):
+        if search_dim >= vectors.shape[1]:
+            continue
+        for storage in ("float", "int8"):
+            index = create_index(vectors, "flat", storage, search_dim)
+            ids, ms = _timed_search(index, queries, k, vectors)
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, exact_ids)])
+            label = f"flat/{storage} dim={search_dim}"
+            print(f"{label:<30}{recall:>10.3f}{ms:>12.3f}{_index_mb(index):>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--type", default=INDEX_TYPE, choices=["flat", "hnsw", "ivf"])
+    parser.add_argument("--storage", default=INDEX_STORAGE, choices=["float", "int8", "binary"])
+    parser.add_argument("--search-dim", type=int, default=SEARCH_DIM)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.k, args.queries)
+    else:
+        rebuild(args.type, args.storage, args.search_dim)
@@ -1,22 +1,116 @@
-import os 
+"""
+Chat persistence: every question/answer turn is appended as one SQLite row.
+
+    python chat_history.py migrate [--remove]   # import legacy chat_data/*.json sessions
+"""
+import sys
 import json
+import time
 import uuid
+import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime
+from tracing import traced
 
 CHAT_DATA_DIR = Path("chat_data")
 CHAT_DATA_DIR.mkdir(parents=True, exist_ok=True)
+CHAT_DB_PATH = CHAT_DATA_DIR / "chats.sqlite"
 
-def save_chat_history(history,  path):
-    path.parent.mkdir(parents=True, exist_ok=True)  # Ensure path exists
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(history, f, indent=2, ensure_ascii=False)
+_local = threading.local()
+
+
+def _conn():
+    # One connection per thread; Streamlit runs each session's script in its own thread
+    if getattr(_local, "db", None) is None:
+        db = sqlite3.connect(CHAT_DB_PATH, timeout=30, isolation_level=None)
+        # WAL + synchronous=NORMAL: commits are appended to the log and fsynced in
+        # batches at checkpoints instead of once per turn
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY, created REAL, updated REAL, title TEXT, turns INTEGER);
+            CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+            CREATE TABLE IF NOT EXISTS turns (
+                session_id TEXT, turn INTEGER, created REAL, question TEXT, answer TEXT, images TEXT,
+                PRIMARY KEY (session_id, turn));
+        """)
+        _local.db = db
+    return _local.db
+
+
+def _session_created(session_id: str) -> float:
+    # generate_session_id() encodes the creation time in the first 15 characters
+    try:
+        return datetime.strptime(session_id[:15], "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        return time.time()
+
+
+@traced("chat_save")
+def append_chat_turn(session_id: str, turn: dict, created: float = None):
+    """Appends one turn; safe when several tabs or processes write the same session."""
+    db = _conn()
+    created = created or time.time()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        number = db.execute("SELECT COALESCE(MAX(turn), 0) + 1 FROM turns WHERE session_id = ?",
+                            (session_id,)).fetchone()[0]
+        db.execute("INSERT INTO turns VALUES (?, ?, ?, ?, ?, ?)",
+                   (session_id, number, created, turn["question"], turn["answer"],
+                    json.dumps(turn.get("images", []), ensure_ascii=False)))
+        db.execute(
+            "INSERT INTO sessions VALUES (?, ?, ?, ?, 1) ON CONFLICT (session_id) "
+            "DO UPDATE SET updated = excluded.updated, turns = turns + 1",
+            (session_id, _session_created(session_id), created, turn["question"][:80]),
+        )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
+def load_chat_history(session_id: str) -> list:
+    rows = _conn().execute(
+        "SELECT question, answer, images FROM turns WHERE session_id = ? ORDER BY turn", (session_id,)
+    ).fetchall()
+    return [{"question": q, "answer": a, "images": json.loads(images)} for q, a, images in rows]
+
+
+def list_chat_sessions(limit: int = 20) -> list:
+    """Most recently updated sessions first."""
+    rows = _conn().execute(
+        "SELECT session_id, title, turns, updated FROM sessions ORDER BY updated DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [{"session_id": s, "title": t, "turns": n, "updated": u} for s, t, n, u in rows]
 
-def load_chat_history(path):
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
 
 def generate_session_id():
     return datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + str(uuid.uuid4())[:8]
+
+
+def migrate_json_sessions(folder: Path = CHAT_DATA_DIR, remove: bool = False) -> int:
+    """Imports legacy one-file-per-session JSON chats; sessions already in the database are skipped."""
+    migrated = 0
+    for path in sorted(Path(folder).glob("*.json")):
+        session_id = path.stem
+        with open(path, "r", encoding="utf-8") as f:
+            history = json.load(f)
+        exists = _conn().execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if not exists:
+            created = _session_created(session_id)
+            for turn in history:
+                append_chat_turn(session_id, turn, created=created)
+            migrated += 1
+        if remove:
+            path.unlink()
+    return migrated
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["migrate"]:
+        print(__doc__)
+        sys.exit(1)
+    count = migrate_json_sessions(remove="--remove" in sys.argv)
+    print(f"✅ Migrated {count} chat sessions into {CHAT_DB_PATH}")
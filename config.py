@@ -1,7 +1,6 @@
 import os
-import cohere
+import functools
 from pathlib import Path
-from openai import OpenAI
 from dotenv import load_dotenv
 
 
@@ -10,15 +9,177 @@ PDF_FOLDER = Path("source_docs")
 IMG_FOLDER = Path("images")
 HASHES_FOLDER = Path("hashes")
 PDF_HASH_FILE = "pdf_hashes.json"
-FAISS_INDEX_PATH = Path("store/image_index.faiss")  # for FAISS index
-FILENAME_MAP_PATH = Path("store/image_filenames.pkl")  # for image path -> index mapping
+STORE_FOLDER = Path("store")
+# Base names of the index files; each published generation N is written as e.g.
+# image_index.N.faiss and named by the manifest, which is replaced atomically
+FAISS_INDEX_PATH = STORE_FOLDER / "image_index.faiss"  # for FAISS index
+FILENAME_MAP_PATH = STORE_FOLDER / "image_filenames.pkl"  # for image path -> index mapping
+VECTORS_PATH = STORE_FOLDER / "image_vectors.npy"  # full-precision vectors the index is built from
+MANIFEST_PATH = STORE_FOLDER / "manifest.json"  # current generation: files, count, model, dim, storage
+PAGE_META_PATH = STORE_FOLDER / "page_meta.npz"  # document, year, page and ingestion time per row
 MODEL_NAME = "embed-v4.0"
+EMBED_DIM = int(os.getenv("EMBED_DIM", 1536))  # Embed v4 output_dimension: 256, 512, 1024 or 1536
+
+# Search index: "flat" (exact), "hnsw" or "ivf". Rebuild with `python build_index.py`.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+IVF_NLIST = int(os.getenv("IVF_NLIST", 0))  # 0 = derive from corpus size
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+# Vector storage in the search index: "float", "int8" (scalar quantized) or "binary".
+# Compressed indexes shortlist top_k * RESCORE_FACTOR pages and rescore them in float.
+INDEX_STORAGE = os.getenv("INDEX_STORAGE", "float")
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", 10))
+# Matryoshka coarse search: index only the leading SEARCH_DIM components (0 = full
+# EMBED_DIM) and re-rank the shortlist with the full vectors.
+SEARCH_DIM = int(os.getenv("SEARCH_DIM", 0))
+# Filtered search (by report, year, page range): filters selecting at most this fraction
+# of the pages score just those rows exactly; broader ones run inside FAISS with an ID
+# selector, falling back to the exact scan if it returns fewer than top_k pages.
+FILTER_SCAN_FRACTION = 0.25
+
+# Content-addressed page embedding cache (append-only float32 vectors + JSON key map)
+EMBED_CACHE_FOLDER = Path("store/embedding_cache")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", 50_000))
+
+# Hybrid retrieval: BM25 over page text extracted at ingestion (one segment per PDF),
+# fused with the vector ranking by reciprocal rank fusion over the top HYBRID_CANDIDATES
+TEXT_INDEX_FOLDER = Path("store/text_index")
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = 50
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Query embedding cache: in-memory LRU backed by SQLite
+CACHE_DB_PATH = Path("store/cache.sqlite")
+QUERY_CACHE_MAX_ITEMS = 1024
+QUERY_CACHE_MAX_DISK_ITEMS = 100_000
+QUERY_CACHE_TTL = 30 * 24 * 3600  # seconds
+QUERY_CACHE_PERSIST = os.getenv("QUERY_CACHE_PERSIST", "1") == "1"
+
+# Semantic answer cache: reuse an LLM answer when a question retrieves the same pages
+# and its embedding is at least this cosine-similar to a cached question
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_MAX_ITEMS = 5000
+# Its own file: writes to the query cache would otherwise look like answer changes to reload
+ANSWER_CACHE_DB_PATH = Path("store/answers.sqlite")
+
+# Questions per co.embed call in batch search (the API accepts up to 96 inputs)
+QUERY_BATCH_SIZE = 96
+
+# Embedding scheduler: pages per co.embed call, concurrent requests and API budgets
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 8))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", 4))
+EMBED_RPM = int(os.getenv("EMBED_RPM", 300))  # requests per minute
+EMBED_TPM = int(os.getenv("EMBED_TPM", 500_000))  # tokens per minute
+EMBED_TOKENS_PER_IMAGE = 1000  # rough token cost of one page image
+# Ingestion checkpoints: the embedding cache is flushed every CHECKPOINT_PAGES pages and
+# a new index generation is published after every PDF, so a crash costs little re-embedding
+CHECKPOINT_PAGES = int(os.getenv("CHECKPOINT_PAGES", 32))
+
+# Outbound API resilience (resilience.py): token-bucket rate limits, full-jitter retries
+# that honour Retry-After, a circuit breaker per endpoint and hedged embed requests
+LLM_RPM = int(os.getenv("LLM_RPM", 500))  # chat completions per minute
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", 4))  # retries after the first try
+RETRY_BASE_DELAY = 1.0  # seconds; retry n sleeps uniform(0, min(RETRY_MAX_DELAY, base * 2**n))
+RETRY_MAX_DELAY = 30.0
+BREAKER_FAILURES = 5  # consecutive failed calls that open an endpoint's circuit
+BREAKER_RESET = 30.0  # seconds an open circuit rejects calls before letting a probe through
+HEDGE_PERCENTILE = 95  # re-issue an idempotent call still pending after this latency percentile
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 0.5))  # seconds; negative disables hedging
+
+# Near-duplicate pages (cover pages, dividers, boilerplate repeated across years) are
+# detected at ingestion by pHash and dHash Hamming distance and stored as aliases of an
+# already indexed page instead of being embedded. The thresholds are deliberately strict:
+# sparse text pages with different wording can sit only a few bits apart.
+DEDUP_PAGES = os.getenv("DEDUP_PAGES", "1") == "1"
+DEDUP_PATH = STORE_FOLDER / "page_dedup.json"  # hashes of representatives + duplicate -> representative
+DEDUP_PHASH_DISTANCE = 4  # of 64 bits
+DEDUP_DHASH_DISTANCE = 8  # of 256 bits
+
+# Upload derivatives: size-bounded, recompressed copies of each page sent to the
+# embedder and the vision LLM, generated at ingestion. They live under Streamlit's
+# static folder (see .streamlit/config.toml) so the gallery modal can fetch them by URL.
+STATIC_FOLDER = Path("static")
+DERIVED_FOLDER = STATIC_FOLDER / "pages"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", 1600))  # pixels
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG")  # JPEG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 80))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "0") == "1"  # for text-heavy corpora
+
+# Gallery thumbnails, also generated at ingestion and served as static files
+THUMB_FOLDER = STATIC_FOLDER / "thumbs"
+THUMB_MAX_EDGE = 480
+THUMB_QUALITY = 70
+
+# Tile mode: each page is also cut into a TILE_ROWS x TILE_COLS grid of overlapping crops
+# (TILE_OVERLAP of a tile's size shared with each neighbour), embedded into a separate
+# tile index in TILE_STORE_FOLDER. Retrieval then ranks pages by their best tiles too
+# and sends the LLM the matched crops instead of whole pages.
+TILE_MODE = os.getenv("TILE_MODE", "0") == "1"
+TILE_STORE_FOLDER = STORE_FOLDER / "tiles"
+TILE_META_PATH = TILE_STORE_FOLDER / "tiles.json"  # tile -> page and bounding box
+TILE_FOLDER = STATIC_FOLDER / "tiles"
+TILE_ROWS = int(os.getenv("TILE_ROWS", 3))
+TILE_COLS = int(os.getenv("TILE_COLS", 2))
+TILE_OVERLAP = 0.15
+
+# Background ingestion (ingest_worker.py): uploads are queued in JOBS_DB_PATH and processed
+# by a separate worker process, INGEST_CONCURRENCY PDFs at a time. The app starts a worker
+# when none has sent a heartbeat for WORKER_STALE_SECONDS.
+JOBS_DB_PATH = STORE_FOLDER / "jobs.sqlite"
+INGEST_LOCK_PATH = STORE_FOLDER / "ingest.lock"  # serializes index updates across processes
+WORKER_LOCK_PATH = STORE_FOLDER / "ingest_worker.lock"  # one worker per store
+WORKER_LOG_PATH = STORE_FOLDER / "ingest_worker.log"
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 2))
+INGEST_AUTOSTART = os.getenv("INGEST_AUTOSTART", "1") == "1"
+INGEST_POLL_SECONDS = 2  # worker queue polling and sidebar progress refresh
+WORKER_STALE_SECONDS = 30
+
+# Headless query service (api_server.py). When RAG_API_URL is set, the Streamlit app
+# sends searches and answers there instead of running them in-process.
+RAG_API_URL = os.getenv("RAG_API_URL")
+API_WORKER_THREADS = int(os.getenv("API_WORKER_THREADS", 64))
+
+# Tracing: per-stage latency samples kept for percentiles, optionally exported as JSONL
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH")  # e.g. store/traces.jsonl
+TRACE_MAX_SAMPLES = 10_000
+
+# Rasterization: pages rendered per worker task bound the memory of each worker
+RASTER_DPI = 200
+RASTER_CHUNK_PAGES = int(os.getenv("RASTER_CHUNK_PAGES", 4))
+RASTER_MAX_WORKERS = int(os.getenv("RASTER_MAX_WORKERS", os.cpu_count() or 2))
+
+
+def ensure_folders():
+    """Creates the working folders; called by the entry points that write to them."""
+    for folder in (PDF_FOLDER, IMG_FOLDER, HASHES_FOLDER):
+        os.makedirs(folder, exist_ok=True)
 
-os.makedirs(PDF_FOLDER, exist_ok=True)
-os.makedirs(IMG_FOLDER, exist_ok=True)
-os.makedirs(HASHES_FOLDER, exist_ok=True)
 
 # Load API keys
 load_dotenv()
-co = cohere.ClientV2(api_key=os.getenv("COHERE_API_KEY"))
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
\ No newline at end of file
+
+
+# API clients are built on first use (importing the SDKs alone takes about a second)
+@functools.lru_cache(maxsize=None)
+def get_cohere_client():
+    import cohere
+    return cohere.ClientV2(api_key=os.getenv("COHERE_API_KEY"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def __getattr__(name):
+    # Keeps `from config import co, client` working without eager construction
+    if name == "co":
+        return get_cohere_client()
+    if name == "client":
+        return get_openai_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,45 @@
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from config import EMBED_BATCH_SIZE, EMBED_MAX_WORKERS
+from utils import embed_images
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def embed_pages(co, img_paths, batch_size=EMBED_BATCH_SIZE, max_workers=EMBED_MAX_WORKERS, cache=None):
+    """
+    Embeds page images in batches with a bounded number of co.embed calls in flight.
+    `img_paths` may be a lazy iterable; yields (img_path, embedding) in input order.
+    With an EmbeddingCache, only pages whose image bytes are not cached hit the API.
+    Rate limits and retries come from the shared embed endpoint (resilience.py).
+    """
+
+    def run(batch):
+        if cache is None:
+            return embed_images(co, batch)
+
+        keys = [cache.key(p) for p in batch]
+        embeddings = [cache.get(k) for k in keys]
+        misses = [i for i, emb in enumerate(embeddings) if emb is None]
+        if misses:
+            for i, emb in zip(misses, embed_images(co, [batch[i] for i in misses])):
+                cache.put(keys[i], emb)
+                embeddings[i] = emb
+        return embeddings
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = deque()
+        for batch in _batches(img_paths, batch_size):
+            in_flight.append((batch, pool.submit(run, batch)))
+            if len(in_flight) >= max_workers:
+                batch, future = in_flight.popleft()
+                yield from zip(batch, future.result())
+
+        while in_flight:
+            batch, future = in_flight.popleft()
+            yield from zip(batch, future.result())
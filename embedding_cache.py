@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from image_prep import PREP_SIGNATURE
+from tracing import traced
+from utils import atomic_write, file_lock
+from config import EMBED_CACHE_FOLDER, EMBED_CACHE_MAX_ENTRIES, EMBED_DIM, MODEL_NAME
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of page embeddings.
+
+    Vectors are appended to a raw float32 file that is read back through np.memmap;
+    a small JSON sidecar maps each key to its row and last-use time. Keys are the
+    SHA-256 of the rendered page bytes plus the model name, embedding type and upload
+    derivative settings, so a re-rendered page with identical pixels reuses its vector.
+    Compaction writes a new vector file that the sidecar switches to atomically, so a
+    crash at any point leaves a sidecar whose rows match the file it names.
+
+    Several processes may share the folder: appends and flushes hold an flock on
+    cache.lock, rows are taken from the file offset, and flush merges the sidecar on disk.
+    """
+
+    def __init__(self, folder: Path = EMBED_CACHE_FOLDER, dim: int = EMBED_DIM,
+                 max_entries: int = EMBED_CACHE_MAX_ENTRIES, model: str = MODEL_NAME,
+                 embedding_type: str = "float"):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.folder / "index.json"
+        self.lock_path = self.folder / "cache.lock"
+        self.dim = dim
+        self.row_bytes = 4 * dim
+        self.max_entries = max_entries
+        self.namespace = f"{model}:{embedding_type}:{PREP_SIGNATURE}".encode()
+        self._lock = threading.Lock()
+        self._mmap = None
+
+        self.slots = {}  # key -> [row, last_used]
+        self._pending = {}  # key -> vector, appended since the last flush
+        self.generation = 0
+        with file_lock(self.lock_path):
+            meta = self._read_sidecar()
+            if meta is not None and meta.get("dim") == dim:
+                self.slots = meta["slots"]
+                self.generation = meta.get("generation", 0)
+            self.vectors_path = self._vectors_file(self.generation)
+            if meta is not None and meta.get("dim") != dim:
+                self.vectors_path.write_bytes(b"")  # rows of another dimension
+            else:
+                self.vectors_path.touch()  # other processes may have appended rows not yet in the sidecar
+
+    def _vectors_file(self, generation: int) -> Path:
+        return self.folder / (f"vectors.{generation}.f32" if generation else "vectors.f32")
+
+    def _read_sidecar(self):
+        if not self.index_path.exists():
+            return None
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def _sync(self):
+        """
+        Merges the sidecar another process may have flushed; call with the file lock held.
+        After a compaction elsewhere, the unflushed vectors are appended to the new file.
+        """
+        meta = self._read_sidecar()
+        if meta is None or meta.get("dim") != self.dim:
+            return
+        disk = meta["slots"]
+        if meta.get("generation", 0) == self.generation:
+            for key, slot in disk.items():
+                mine = self.slots.get(key)
+                if mine is None:
+                    self.slots[key] = slot
+                else:
+                    mine[1] = max(mine[1], slot[1])
+            return
+        self.generation = meta.get("generation", 0)
+        self.vectors_path = self._vectors_file(self.generation)
+        self._mmap = None
+        last_used = {key: slot[1] for key, slot in self.slots.items()}
+        self.slots = disk
+        for key, slot in self.slots.items():
+            slot[1] = max(slot[1], last_used.get(key, 0))
+        for key, vec in self._pending.items():
+            self.slots[key] = [self._append(vec), last_used.get(key, time.time())]
+
+    def _append(self, vec) -> int:
+        """Appends one vector and returns its row, taken from the file offset; needs the file lock."""
+        with open(self.vectors_path, "ab") as f:
+            end = f.seek(0, os.SEEK_END)
+            if end % self.row_bytes:
+                end -= end % self.row_bytes  # a partial row left by a crash
+                f.truncate(end)
+            f.write(vec.tobytes())
+        return end // self.row_bytes
+
+    def _file_rows(self) -> int:
+        return self.vectors_path.stat().st_size // self.row_bytes
+
+    @traced("hash")
+    def key(self, img_path: str) -> str:
+        sha256 = hashlib.sha256(self.namespace)
+        with open(img_path, "rb") as f:
+            while chunk := f.read(1 << 16):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                return None
+            slot[1] = time.time()
+            if self._mmap is None or slot[0] >= len(self._mmap):
+                if not self.vectors_path.exists():
+                    # Another process compacted the cache: switch to its file
+                    with file_lock(self.lock_path):
+                        self._sync()
+                    slot = self.slots[key]
+                self._mmap = np.memmap(self.vectors_path, dtype="float32", mode="r",
+                                       shape=(self._file_rows(), self.dim))
+            return np.array(self._mmap[slot[0]])
+
+    def put(self, key: str, embedding):
+        vec = np.asarray(embedding, dtype="float32").reshape(self.dim)
+        with self._lock, file_lock(self.lock_path):
+            if not self.vectors_path.exists():
+                self._sync()
+            self.slots[key] = [self._append(vec), time.time()]
+            self._pending[key] = vec
+
+    def flush(self):
+        """Merges the sidecar on disk, applies LRU eviction, compacts if mostly dead, and writes the sidecar."""
+        with self._lock, file_lock(self.lock_path):
+            self._sync()
+            if len(self.slots) > self.max_entries:
+                by_age = sorted(self.slots, key=lambda k: self.slots[k][1])
+                for key in by_age[:len(self.slots) - self.max_entries]:
+                    del self.slots[key]
+
+            old_path = self.vectors_path
+            if self._file_rows() > 2 * len(self.slots):
+                self._compact()
+            else:
+                # Appended rows must be on disk before the sidecar refers to them
+                with open(self.vectors_path, "ab") as f:
+                    os.fsync(f.fileno())
+
+            with atomic_write(self.index_path, "w") as f:
+                json.dump({"dim": self.dim, "generation": self.generation, "slots": self.slots}, f)
+            self._pending.clear()
+            if self.vectors_path != old_path:
+                old_path.unlink(missing_ok=True)
+
+    def _compact(self):
+        old = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(self._file_rows(), self.dim))
+        keys = sorted(self.slots, key=lambda k: self.slots[k][0])
+        live = np.array(old[[self.slots[k][0] for k in keys]]) if keys else np.empty((0, self.dim), "float32")
+        del old
+        self._mmap = None
+
+        self.generation += 1
+        self.vectors_path = self._vectors_file(self.generation)
+        with atomic_write(self.vectors_path) as f:
+            live.tofile(f)
+        for row, key in enumerate(keys):
+            self.slots[key][0] = row
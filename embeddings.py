@@ -1,15 +1,42 @@
 import json
 import numpy as np
-from config import MODEL_NAME
-from utils import retry
+from config import MODEL_NAME, EMBED_DIM, QUERY_BATCH_SIZE
+from resilience import embed_endpoint
+from tracing import traced
+from query_cache import QueryEmbeddingCache
+
+query_cache = QueryEmbeddingCache()
+
 
-@retry(retries=4, backoff=3)
 def get_query_embedding(query: str, co):
-    response = co.embed(
-        model="embed-v4.0",
+    """Embeds a search query, skipping the API call for questions seen before."""
+    return get_query_embeddings([query], co)[0]
+
+
+def get_query_embeddings(queries: list, co, batch_size: int = QUERY_BATCH_SIZE) -> list:
+    """Embeds many queries with one co.embed call per `batch_size` uncached queries."""
+    keys = [query_cache.key(q) for q in queries]
+    embeddings = [query_cache.get(k) for k in keys]
+    misses = [i for i, emb in enumerate(embeddings) if emb is None]
+
+    for start in range(0, len(misses), batch_size):
+        batch = misses[start:start + batch_size]
+        for i, embedding in zip(batch, _embed_queries([queries[i] for i in batch], co)):
+            query_cache.put(keys[i], embedding)
+            embeddings[i] = embedding
+    return embeddings
+
+
+@traced("embed_query")
+def _embed_queries(queries: list, co):
+    response = embed_endpoint.call(
+        co.embed,
+        tokens=sum(len(q) // 4 + 1 for q in queries),  # rough text token count
+        idempotent=True,
+        model=MODEL_NAME,
         input_type="search_query",
         embedding_types=["float"],
-        inputs=[{"text": query}]
+        output_dimension=EMBED_DIM,
+        inputs=[{"text": query} for query in queries]
     )
-    return np.asarray(response.embeddings.float[0])
-
+    return [np.asarray(emb, dtype="float32") for emb in response.embeddings.float]
@@ -1,34 +1,457 @@
 import os
+import json
+import math
+import time
 import faiss
+import threading
 import pickle
 import numpy as np
 from pathlib import Path
-from config import FAISS_INDEX_PATH, FILENAME_MAP_PATH
+from tracing import traced
+from utils import atomic_write, fsync_dir
+from page_meta import build_page_meta, ingestion_times
+from config import (FAISS_INDEX_PATH, FILENAME_MAP_PATH, VECTORS_PATH, MANIFEST_PATH,
+                    PAGE_META_PATH, STORE_FOLDER, MODEL_NAME, EMBED_DIM,
+                    INDEX_TYPE, INDEX_STORAGE, SEARCH_DIM, RESCORE_FACTOR, HNSW_M, HNSW_EF_CONSTRUCTION,
+                    HNSW_EF_SEARCH, IVF_NLIST, IVF_NPROBE, FILTER_SCAN_FRACTION)
 
 def normalize(vec):
     norm = np.linalg.norm(vec)
     return vec / norm if norm > 0 else vec
 
-def load_faiss_index():
-    if FAISS_INDEX_PATH.exists() and FILENAME_MAP_PATH.exists():
-        index = faiss.read_index(str(FAISS_INDEX_PATH))
-        with open(FILENAME_MAP_PATH, "rb") as f:
-            filenames = pickle.load(f)
+
+def _index_vectors(index):
+    """Reconstructs every stored vector; works for Flat, HNSW and IVF indexes."""
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass  # not an IVF index
+    return index.reconstruct_n(0, index.ntotal) if index.ntotal else np.empty((0, index.d), "float32")
+
+
+def _base(store: Path, path: Path) -> Path:
+    """`path` (a config path under STORE_FOLDER) relocated into another store folder."""
+    return Path(store) / path.name
+
+
+def load_manifest(store: Path = STORE_FOLDER):
+    """
+    The published index generation of a store folder: {"generation", "count", "model",
+    "dim", "storage", "files": {"index", "vectors", "filenames", "meta"}}. Stores written before
+    manifests existed (a flat image_index.faiss and image_filenames.pkl) are described as
+    generation 0 over those two files.
+    """
+    manifest_path = _base(store, MANIFEST_PATH)
+    if manifest_path.exists():
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    else:
+        manifest = {"generation": 0, "storage": "float",
+                    "files": {"index": FAISS_INDEX_PATH.name, "filenames": FILENAME_MAP_PATH.name}}
+    manifest["folder"] = str(store)  # not persisted; lets the loaders find the files
+    return manifest
+
+
+def _store_file(manifest: dict, kind: str) -> Path:
+    return Path(manifest["folder"]) / manifest["files"][kind]
+
+
+def load_vectors(manifest: dict = None):
+    """Full-precision, normalized page vectors aligned with the filename list."""
+    manifest = manifest or load_manifest()
+    if "vectors" in manifest["files"]:
+        return np.load(_store_file(manifest, "vectors"))
+    index_path = _store_file(manifest, "index")
+    if index_path.exists():
+        # Generation 0 only has the flat index
+        return _index_vectors(faiss.read_index(str(index_path)))
+    return np.empty((0, EMBED_DIM), "float32")
+
+
+def load_filenames(manifest: dict = None):
+    path = _store_file(manifest or load_manifest(), "filenames")
+    if path.exists():
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    return []
+
+
+def load_page_meta(manifest: dict = None) -> dict:
+    """Metadata table aligned with the filename list (see page_meta.build_page_meta)."""
+    manifest = manifest or load_manifest()
+    if "meta" in manifest["files"]:
+        with np.load(_store_file(manifest, "meta")) as table:
+            return {column: table[column] for column in table.files}
+    # Generations published before the table existed: derived from the filenames
+    created = manifest.get("created")
+    filenames_path = _store_file(manifest, "filenames")
+    if created is None and filenames_path.exists():
+        created = filenames_path.stat().st_mtime
+    return build_page_meta(load_filenames(manifest), default_time=created)
+
+
+def _check_manifest(manifest: dict, count: int, filenames: list):
+    """Refuses a generation whose files disagree with its manifest or with the configured model."""
+    if not manifest["generation"]:
+        return
+    if manifest["model"] != MODEL_NAME:
+        raise ValueError(f"Index was built with {manifest['model']} but MODEL_NAME is {MODEL_NAME}; "
+                         f"re-ingest the PDFs to rebuild it")
+    if manifest["dim"] != EMBED_DIM:
+        raise ValueError(f"Index was built with {manifest['dim']}-dimensional vectors but EMBED_DIM is "
+                         f"{EMBED_DIM}; re-ingest the PDFs to rebuild it")
+    if not count == len(filenames) == manifest["count"]:
+        raise RuntimeError(f"Index generation {manifest['generation']} is inconsistent: manifest says "
+                           f"{manifest['count']} pages, found {count} vectors and {len(filenames)} filenames")
+
+
+def truncate(vectors, dim: int):
+    """Matryoshka truncation: keep the leading `dim` components and renormalize."""
+    vectors = np.atleast_2d(vectors)[:, :dim]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms > 0, norms, 1)).astype("float32")
+
+
+def create_index(vectors, index_type: str = INDEX_TYPE, storage: str = INDEX_STORAGE,
+                 search_dim: int = SEARCH_DIM, nlist: int = IVF_NLIST):
+    """
+    Builds a search index over `vectors`: exact "flat", graph-based "hnsw", or "ivf"
+    with centroids trained on the vectors themselves. `storage` selects full "float"
+    vectors, 8-bit scalar-quantized "int8" codes, or 1-bit-per-dimension "binary" codes.
+    A `search_dim` below the vector size indexes a truncated Matryoshka copy instead.
+    Compressed and truncated indexes are rescored against the full vectors by search_index().
+    """
+    if search_dim and search_dim < vectors.shape[1]:
+        vectors = truncate(vectors, search_dim)
+    n, dim = vectors.shape
+    if index_type not in ("flat", "hnsw", "ivf"):
+        raise ValueError(f"Unknown index type: {index_type}")
+    if storage not in ("float", "int8", "binary"):
+        raise ValueError(f"Unknown index storage: {storage}")
+    if index_type == "ivf" and n == 0:
+        index_type = "flat"  # an empty IVF index cannot be trained; it becomes IVF on the next rebuild
+    # faiss wants ~39 training points per centroid
+    nlist = nlist or max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+    if storage == "binary":
+        codes = np.packbits(vectors > 0, axis=1)
+        if index_type == "hnsw":
+            index = faiss.IndexBinaryHNSW(dim, HNSW_M)
+        elif index_type == "ivf":
+            index = faiss.IndexBinaryIVF(faiss.IndexBinaryFlat(dim), dim, nlist)
+            index.train(codes)
+        else:
+            index = faiss.IndexBinaryFlat(dim)
+        index.add(codes)
+        set_search_params(index)
+        return index
+
+    metric = faiss.METRIC_INNER_PRODUCT
+    sq8 = faiss.ScalarQuantizer.QT_8bit
+    if index_type == "hnsw":
+        if storage == "int8":
+            index = faiss.IndexHNSWSQ(dim, sq8, HNSW_M, metric)
+        else:
+            index = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif index_type == "ivf":
+        if storage == "int8":
+            index = faiss.IndexIVFScalarQuantizer(faiss.IndexFlatIP(dim), dim, nlist, sq8, metric)
+        else:
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, metric)
+    elif storage == "int8":
+        index = faiss.IndexScalarQuantizer(dim, sq8, metric)
+    else:
+        index = faiss.IndexFlatIP(dim)
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    set_search_params(index)
+    return index
+
+
+def set_search_params(index, ef_search: int = HNSW_EF_SEARCH, nprobe: int = IVF_NPROBE):
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    if isinstance(index, faiss.IndexBinary):
+        if isinstance(index, faiss.IndexBinaryIVF):
+            index.nprobe = nprobe
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+
+
+def _is_exact(index):
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat, faiss.IndexIVFFlat))
+
+
+_vectors_cache = {}  # store folder -> (vectors or index file, mtime, vectors)
+
+
+def _mapped_vectors(manifest: dict = None):
+    """Full-precision vectors, memory-mapped so rescoring only pages in the rows it touches."""
+    manifest = manifest or load_manifest()
+    if "vectors" in manifest["files"]:
+        path = _store_file(manifest, "vectors")
+        load = lambda: np.load(path, mmap_mode="r")
+    else:
+        # Generation 0 has no vectors file: reconstructed once from the flat index
+        path = _store_file(manifest, "index")
+        if not path.exists():
+            return load_vectors(manifest)
+        load = lambda: load_vectors(manifest)
+    mtime = path.stat().st_mtime_ns
+    cached = _vectors_cache.get(path.parent)
+    if cached is None or cached[:2] != (path, mtime):
+        cached = _vectors_cache[path.parent] = (path, mtime, load())
+    return cached[2]
+
+
+@traced("faiss_search")
+def search_index(index, queries, top_k: int, vectors=None, params=None):
+    """
+    Searches one or more normalized queries. Exact full-dimension indexes are searched
+    directly; compressed or truncated ones fetch top_k * RESCORE_FACTOR candidates and
+    re-rank them with the full-precision vectors. Returns (scores, ids) shaped (n_queries, top_k).
+    """
+    queries = np.atleast_2d(queries).astype("float32")
+    truncated = index.d < queries.shape[1]
+    if _is_exact(index) and not truncated:
+        return index.search(queries, top_k, params=params)
+
+    coarse = truncate(queries, index.d) if truncated else queries
+    shortlist = min(top_k * RESCORE_FACTOR, index.ntotal)
+    if isinstance(index, faiss.IndexBinary):
+        _, candidates = index.search(np.packbits(coarse > 0, axis=1), shortlist)
     else:
-        # Load dynamic dimension based on Cohere embed model
-        dummy_vec = np.zeros(1536, dtype="float32")  # Change 1024 to actual size if needed
-        index = faiss.IndexFlatIP(len(dummy_vec))
-        filenames = []
+        _, candidates = index.search(coarse, shortlist, params=params)
+    if vectors is None:
+        vectors = _mapped_vectors(_manifest_for(index))
+    return rescore(queries, candidates, top_k, vectors)
 
+
+def _selector_params(index, ids):
+    """faiss SearchParameters restricting a float index to the rows `ids`, with its usual settings."""
+    selector = faiss.IDSelectorBatch(ids)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    try:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=selector)
+
+
+def scan_rows(queries, ids, top_k: int, vectors):
+    """Exact scores of the rows `ids` only; reads just those rows of the memmapped vectors."""
+    queries = np.atleast_2d(queries).astype("float32")
+    # A document's pages are stored contiguously: score runs of rows as slices, not gathers
+    runs = np.split(ids, np.flatnonzero(np.diff(ids) != 1) + 1)
+    scores = np.concatenate([queries @ vectors[run[0]:run[-1] + 1].T for run in runs], axis=1)
+    if top_k < scores.shape[1]:
+        top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), (len(queries), scores.shape[1]))
+    order = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+    return np.take_along_axis(scores, order, axis=1), ids[order]
+
+
+@traced("faiss_filtered_search")
+def search_subset(index, queries, top_k: int, ids, vectors=None):
+    """
+    search_index() restricted to the rows `ids` (sorted int64), returning min(top_k, len(ids))
+    results per query. Selective filters are scored exactly over their rows; broad ones
+    are searched inside FAISS with an ID selector (binary indexes ignore selectors).
+    """
+    queries = np.atleast_2d(queries).astype("float32")
+    top_k = min(top_k, len(ids))
+    if vectors is None:
+        vectors = _mapped_vectors(_manifest_for(index))
+    if len(ids) > FILTER_SCAN_FRACTION * index.ntotal and not isinstance(index, faiss.IndexBinary):
+        D, I = search_index(index, queries, top_k, vectors, params=_selector_params(index, ids))
+        # Approximate indexes may run out of selected neighbours before top_k
+        if (I >= 0).all():
+            return D, I
+    return scan_rows(queries, ids, top_k, vectors)
+
+
+def rescore(queries, candidates, top_k: int, vectors):
+    scores = np.full((len(queries), top_k), -np.inf, dtype="float32")
+    ids = np.full((len(queries), top_k), -1, dtype="int64")
+    for row, (query, cand) in enumerate(zip(queries, candidates)):
+        cand = np.sort(cand[cand >= 0])  # sorted rows read the memmap sequentially
+        if not len(cand):
+            continue
+        cand_scores = np.asarray(vectors[cand]) @ query
+        order = np.argsort(-cand_scores)[:top_k]
+        scores[row, :len(order)] = cand_scores[order]
+        ids[row, :len(order)] = cand[order]
+    return scores, ids
+
+
+def load_faiss_index(store: Path = STORE_FOLDER):
+    """
+    Exact, mutable working copy used by ingestion; always a flat index whose dimension
+    comes from the stored vectors (or EMBED_DIM for a new store).
+    """
+    manifest = load_manifest(store)
+    vectors = load_vectors(manifest)
+    filenames = load_filenames(manifest)
+    _check_manifest(manifest, len(vectors), filenames)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
     return index, filenames
 
 
-def save_faiss_index(index, filenames):
-    faiss.write_index(index, str(FAISS_INDEX_PATH))
-    with open(FILENAME_MAP_PATH, "wb") as f:
+def _generation_file(base: Path, generation: int) -> Path:
+    return base.with_name(f"{base.stem}.{generation}{base.suffix}")
+
+
+def publish_generation(vectors, filenames: list, index, storage: str, store: Path = STORE_FOLDER,
+                       refreshed=()):
+    """
+    Writes vectors, filenames, page metadata and search index as a new generation of files,
+    then publishes it by atomically replacing the manifest. Readers see either the previous
+    generation or the complete new one; generations older than the previous are deleted.
+    Documents in `refreshed` (and new ones) are stamped with the current ingestion time.
+    """
+    if not len(vectors) == len(filenames) == index.ntotal:
+        raise ValueError(f"Refusing to publish {len(vectors)} vectors, {len(filenames)} filenames "
+                         f"and an index of {index.ntotal}")
+    previous = load_manifest(store)
+    generation = previous["generation"] + 1
+    files = {kind: _generation_file(_base(store, base), generation)
+             for kind, base in (("index", FAISS_INDEX_PATH), ("vectors", VECTORS_PATH),
+                                ("filenames", FILENAME_MAP_PATH), ("meta", PAGE_META_PATH))}
+    ingested = {document: t for document, t in ingestion_times(load_page_meta(previous)).items()
+                if document not in set(refreshed)}
+
+    Path(store).mkdir(parents=True, exist_ok=True)
+    with atomic_write(files["vectors"]) as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype="float32"))
+    with atomic_write(files["filenames"]) as f:
         pickle.dump(filenames, f)
+    with atomic_write(files["meta"]) as f:
+        np.savez(f, **build_page_meta(filenames, ingested))
+    with atomic_write(files["index"]) as f:
+        serialized = faiss.serialize_index_binary(index) if storage == "binary" else faiss.serialize_index(index)
+        f.write(serialized.tobytes())
+
+    manifest = {"generation": generation, "count": index.ntotal, "model": MODEL_NAME,
+                "dim": int(vectors.shape[1]) if vectors.ndim == 2 else EMBED_DIM, "search_dim": index.d,
+                "storage": storage, "created": time.time(),
+                "files": {kind: path.name for kind, path in files.items()}}
+    with atomic_write(_base(store, MANIFEST_PATH), "w") as f:
+        json.dump(manifest, f, indent=2)
+    fsync_dir(store)
+    _remove_generations_before(store, generation - 1)
+    return {**manifest, "folder": str(store)}
+
+
+def _remove_generations_before(store: Path, generation: int):
+    for base in (FAISS_INDEX_PATH, VECTORS_PATH, FILENAME_MAP_PATH, PAGE_META_PATH):
+        base = _base(store, base)
+        for path in base.parent.glob(f"{base.stem}.*{base.suffix}"):
+            number = path.name[len(base.stem) + 1:-len(base.suffix)]
+            if number.isdigit() and int(number) < generation:
+                path.unlink(missing_ok=True)
+
+
+def load_search_index(manifest: dict = None):
+    """The configured (possibly approximate or compressed) index used to answer queries."""
+    manifest = manifest or load_manifest()
+    index_path = _store_file(manifest, "index")
+    if index_path.exists():
+        if manifest["storage"] == "binary":
+            index = faiss.read_index_binary(str(index_path))
+        else:
+            index = faiss.read_index(str(index_path))
+        set_search_params(index)
+    else:
+        index = faiss.IndexFlatIP(EMBED_DIM)
+    filenames = load_filenames(manifest)
+    _check_manifest(manifest, index.ntotal, filenames)
+    return index, filenames
+
+
+_index_lock = threading.Lock()
+_cached_indexes = {}  # store folder -> (signature, index, filenames, manifest)
+_cached_meta = {}  # store folder -> (generation, page metadata table)
+
+
+def _index_signature(store: Path):
+    manifest_path = _base(store, MANIFEST_PATH)
+    try:
+        if manifest_path.exists():
+            return manifest_path.stat().st_mtime_ns
+        return (_base(store, FAISS_INDEX_PATH).stat().st_mtime_ns,
+                _base(store, FILENAME_MAP_PATH).stat().st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def get_faiss_index(store: Path = STORE_FOLDER):
+    """
+    Process-wide, read-only copy of the index for queries. It is loaded once and swapped
+    for the new generation when the manifest changes; queries already holding the old
+    index keep using it. Ingestion must keep using load_faiss_index(), which returns a
+    private copy it can mutate.
+    """
+    signature = _index_signature(store)
+    cached = _cached_indexes.get(store)
+    if cached is not None and cached[0] == signature:
+        return cached[1], cached[2]
+
+    # Another thread is already reloading: serve the previous index rather than wait
+    if not _index_lock.acquire(blocking=cached is None):
+        return cached[1], cached[2]
+    try:
+        cached = _cached_indexes.get(store)
+        if cached is None or cached[0] != signature:
+            manifest = load_manifest(store)
+            index, filenames = load_search_index(manifest)
+            cached = _cached_indexes[store] = (signature, index, filenames, manifest)
+        return cached[1], cached[2]
+    finally:
+        _index_lock.release()
+
+
+def _manifest_for(index):
+    for cached in list(_cached_indexes.values()):
+        if cached[1] is index:
+            return cached[3]
+    return None
+
+
+def page_meta_for(index):
+    """Metadata table of an index returned by get_faiss_index(), loaded once per generation."""
+    manifest = _manifest_for(index) or load_manifest()
+    cached = _cached_meta.get(manifest["folder"])
+    if cached is None or cached[0] != manifest["generation"]:
+        cached = _cached_meta[manifest["folder"]] = (manifest["generation"], load_page_meta(manifest))
+    return cached[1]
+
+
+def save_faiss_index(index, filenames, store: Path = STORE_FOLDER, refreshed=()):
+    """Publishes the working copy's vectors as a new generation with the configured search index."""
+    vectors = _index_vectors(index)
+    return publish_generation(vectors, filenames, create_index(vectors), INDEX_STORAGE, store, refreshed)
+
 
 def add_embedding(index, filenames, embedding, image_name):
     norm_embedding = normalize(embedding).astype("float32")
     index.add(norm_embedding[np.newaxis, :])
     filenames.append(image_name)
+
+
+def remove_embeddings(index, filenames, image_names):
+    """Drops the given images from the index and the filename list, keeping both aligned."""
+    image_names = set(image_names)
+    ids = [i for i, name in enumerate(filenames) if name in image_names]
+    if not ids:
+        return 0
+    index.remove_ids(np.asarray(ids, dtype="int64"))
+    filenames[:] = [name for name in filenames if name not in image_names]
+    return len(ids)
@@ -0,0 +1,84 @@
+"""
+Deterministic local stand-ins for the Cohere and OpenAI clients, for benchmarks and
+offline runs. Each accepts the same call shapes the project uses, sleeps for a
+configurable latency and fails a configurable fraction of calls.
+"""
+import time
+import hashlib
+import threading
+import numpy as np
+from types import SimpleNamespace
+from config import EMBED_DIM
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code: int, retry_after: float = None):
+        super().__init__(f"fake API error {status_code}")
+        self.status_code = status_code
+        self.headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+
+
+class _FakeService:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.calls = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def _simulate(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self.jitter * self._rng.random()
+            fail = self._rng.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            raise FakeAPIError(self.error_status)
+
+
+class FakeCohere(_FakeService):
+    """co.embed() returning unit vectors derived from a hash of each input."""
+
+    def __init__(self, dim: int = EMBED_DIM, **kwargs):
+        super().__init__(**kwargs)
+        self.dim = dim
+
+    def _vector(self, item) -> list:
+        if isinstance(item, dict) and "text" in item:
+            payload = item["text"]
+        elif isinstance(item, dict):
+            payload = "".join(c.get("image", c.get("text", "")) for c in item.get("content", []))
+        else:
+            payload = str(item)
+        seed = int.from_bytes(hashlib.sha256(payload.encode()).digest()[:8], "little")
+        vec = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    def embed(self, inputs=None, texts=None, output_dimension=None, **kwargs):
+        self._simulate()
+        items = inputs if inputs is not None else texts
+        vectors = [self._vector(item)[:output_dimension or self.dim] for item in items]
+        return SimpleNamespace(embeddings=SimpleNamespace(float=vectors))
+
+
+class FakeOpenAI(_FakeService):
+    """client.chat.completions.create() with a canned answer, streamed in `chunks` pieces."""
+
+    def __init__(self, answer: str = "This is a benchmark answer from the fake vision model.",
+                 chunks: int = 10, **kwargs):
+        super().__init__(**kwargs)
+        self.answer = answer
+        self.chunks = chunks
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, stream: bool = False, **kwargs):
+        self._simulate()
+        if not stream:
+            message = SimpleNamespace(content=self.answer)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        size = max(1, len(self.answer) // self.chunks)
+        pieces = [self.answer[i:i + size] for i in range(0, len(self.answer), size)]
+        return (SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=p))]) for p in pieces)
@@ -0,0 +1,106 @@
+import os
+import threading
+from pathlib import Path
+from config import (DERIVED_FOLDER, IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_GRAYSCALE,
+                    STATIC_FOLDER, THUMB_FOLDER, THUMB_MAX_EDGE, THUMB_QUALITY, TILE_FOLDER, TILE_ROWS,
+                    TILE_COLS, TILE_OVERLAP)
+
+# Identifies the derivative settings; cached embeddings of derivatives are keyed by it
+PREP_SIGNATURE = f"{IMAGE_MAX_EDGE}:{IMAGE_FORMAT}:{IMAGE_QUALITY}:{int(IMAGE_GRAYSCALE)}"
+
+_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+
+def derivative_path(img_path: str) -> Path:
+    suffix = f"_{IMAGE_MAX_EDGE}q{IMAGE_QUALITY}{'g' if IMAGE_GRAYSCALE else ''}"
+    return DERIVED_FOLDER / f"{Path(img_path).stem}{suffix}{_EXTENSIONS[IMAGE_FORMAT]}"
+
+
+def _write_derivative(img_path: str, out_path: Path, max_edge: int, fmt: str, quality: int,
+                      grayscale: bool = False) -> str:
+    if out_path.exists() and out_path.stat().st_mtime >= Path(img_path).stat().st_mtime:
+        return str(out_path)
+
+    from PIL import Image  # deferred: only ingestion and first-use derivatives need Pillow
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(img_path) as img:
+        _save_derivative(img, out_path, max_edge, fmt, quality, grayscale)
+    return str(out_path)
+
+
+def _save_derivative(img, out_path: Path, max_edge: int, fmt: str, quality: int, grayscale: bool = False):
+    from PIL import Image
+    img = img.convert("L" if grayscale else "RGB")
+    img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    # Write under a temp name so a concurrent reader never sees a partial file
+    tmp_path = out_path.with_name(f".{out_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    img.save(tmp_path, fmt, quality=quality, optimize=True)
+    tmp_path.replace(out_path)
+
+
+def prepare_image(img_path: str) -> str:
+    """
+    Returns a size-bounded copy of a page image for upload to the embedder and the LLM,
+    creating it on first use or when the original page has been re-rendered since.
+    Tiles are cut as upload-ready derivatives and are returned unchanged.
+    """
+    if Path(img_path).parent == TILE_FOLDER:
+        return str(img_path)
+    return _write_derivative(img_path, derivative_path(img_path), IMAGE_MAX_EDGE,
+                             IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_GRAYSCALE)
+
+
+def make_thumbnail(img_path: str) -> str:
+    """Small JPEG preview of a page for the chat gallery."""
+    return _write_derivative(img_path, THUMB_FOLDER / f"{Path(img_path).stem}.jpg",
+                             THUMB_MAX_EDGE, "JPEG", THUMB_QUALITY)
+
+
+def static_url(path: str) -> str:
+    """URL under which Streamlit's static file serving exposes a file in STATIC_FOLDER."""
+    return "app/static/" + Path(path).relative_to(STATIC_FOLDER).as_posix()
+
+
+def tile_boxes(width: int, height: int, rows: int = TILE_ROWS, cols: int = TILE_COLS,
+               overlap: float = TILE_OVERLAP) -> list:
+    """(row, col, (left, top, right, bottom)) pixel boxes of an overlapping grid covering the page."""
+    tile_w = width / (cols - (cols - 1) * overlap)
+    tile_h = height / (rows - (rows - 1) * overlap)
+    boxes = []
+    for r in range(rows):
+        for c in range(cols):
+            left, top = c * tile_w * (1 - overlap), r * tile_h * (1 - overlap)
+            boxes.append((r, c, (round(left), round(top), min(width, round(left + tile_w)),
+                                 min(height, round(top + tile_h)))))
+    return boxes
+
+
+def tile_name(page_name: str, row: int, col: int) -> str:
+    return f"{Path(page_name).stem}_t{row}{col}{_EXTENSIONS[IMAGE_FORMAT]}"
+
+
+def page_of_tile(name: str) -> str:
+    """Page image name a tile was cut from."""
+    return Path(name).stem.rsplit("_t", 1)[0] + ".png"
+
+
+def make_tiles(img_path: str) -> list:
+    """
+    Cuts a page into overlapping upload-ready crops in TILE_FOLDER, reusing crops newer
+    than the page. Returns [(tile path, [left, top, right, bottom] as fractions of the page)].
+    """
+    from PIL import Image
+    TILE_FOLDER.mkdir(parents=True, exist_ok=True)
+    page_mtime = Path(img_path).stat().st_mtime
+    tiles = []
+    with Image.open(img_path) as page:
+        width, height = page.size
+        for row, col, box in tile_boxes(width, height):
+            out_path = TILE_FOLDER / tile_name(img_path, row, col)
+            bbox = [box[0] / width, box[1] / height, box[2] / width, box[3] / height]
+            tiles.append((str(out_path), bbox))
+            if out_path.exists() and out_path.stat().st_mtime >= page_mtime:
+                continue
+            _save_derivative(page.crop(box), out_path, IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY,
+                             IMAGE_GRAYSCALE)
+    return tiles
@@ -0,0 +1,258 @@
+"""
+Background ingestion: a durable SQLite job queue and the worker process that drains it.
+
+    python ingest_worker.py                        # run a worker (the app starts one on upload)
+    python ingest_worker.py source_docs/x.pdf --once   # queue PDFs, process the queue, exit
+
+Uploads are queued and return at once. The worker runs up to INGEST_CONCURRENCY jobs at a
+time: each rasterizes its PDF and embeds the pages into the shared embedding cache
+alongside the others (every embed call goes through the same rate-limited endpoint), then
+merges them into the index under INGEST_LOCK_PATH, publishing a new generation that query
+processes pick up. Jobs record per-page progress; a job whose worker stops sending
+heartbeats is queued again.
+"""
+import os
+import sys
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import traceback
+import subprocess
+from pathlib import Path
+from config import (JOBS_DB_PATH, WORKER_LOCK_PATH, WORKER_LOG_PATH, INGEST_CONCURRENCY, INGEST_POLL_SECONDS,
+                    WORKER_STALE_SECONDS, IMG_FOLDER, TILE_MODE, DEDUP_PAGES)
+
+
+ACTIVE = "('queued', 'running', 'merging')"  # statuses of unfinished jobs, as SQL
+
+
+class JobQueue:
+    """Ingestion jobs in SQLite: queued -> running -> merging -> done | failed, with page progress."""
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")  # the app polls while the worker writes
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY, pdf_path TEXT, document TEXT, sha256 TEXT, status TEXT, "
+                "pages_done INTEGER DEFAULT 0, pages_total INTEGER, generation INTEGER, error TEXT, "
+                "worker TEXT, created REAL, started REAL, finished REAL, heartbeat REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            db.execute("CREATE TABLE IF NOT EXISTS workers (name TEXT PRIMARY KEY, heartbeat REAL)")
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._conn().execute(sql, params).fetchall()]
+
+    def enqueue(self, pdf_path, sha256: str) -> int:
+        """Queues a PDF unless the same version of it is already queued or running; returns the job id."""
+        document = Path(pdf_path).stem
+        active = self.active_job(document)
+        if active is not None and active["sha256"] == sha256:
+            return active["id"]
+        rows = self._execute(
+            "INSERT INTO jobs (pdf_path, document, sha256, status, created) VALUES (?, ?, ?, 'queued', ?) "
+            "RETURNING id", (str(pdf_path), document, sha256, time.time()))
+        return rows[0]["id"]
+
+    def job(self, job_id: int):
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def active_job(self, document: str):
+        rows = self._execute(f"SELECT * FROM jobs WHERE document = ? AND status IN {ACTIVE} "
+                             "ORDER BY id DESC LIMIT 1", (document,))
+        return rows[0] if rows else None
+
+    def claim(self, worker: str):
+        """Atomically moves the oldest queued job to running; None when the queue is empty."""
+        now = time.time()
+        rows = self._execute(
+            "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ?, pages_done = 0 "
+            "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1) RETURNING *",
+            (worker, now, now))
+        return rows[0] if rows else None
+
+    def progress(self, job_id: int, pages_done: int, pages_total: int = None):
+        self._execute("UPDATE jobs SET pages_done = ?, pages_total = COALESCE(?, pages_total), heartbeat = ? "
+                      "WHERE id = ?", (pages_done, pages_total, time.time(), job_id))
+
+    def merging(self, job_id: int):
+        self._execute("UPDATE jobs SET status = 'merging', heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: int, generation: int):
+        self._execute("UPDATE jobs SET status = 'done', generation = ?, finished = ? WHERE id = ?",
+                      (generation, time.time(), job_id))
+
+    def fail(self, job_id: int, error: str):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                      (error, time.time(), job_id))
+
+    def recent(self, limit: int = 5) -> list:
+        """Active jobs first, then the latest finished ones."""
+        return self._execute(
+            f"SELECT * FROM jobs ORDER BY status NOT IN {ACTIVE}, id DESC LIMIT ?", (limit,))
+
+    def has_active(self) -> bool:
+        return bool(self._execute(f"SELECT 1 FROM jobs WHERE status IN {ACTIVE} LIMIT 1"))
+
+    def heartbeat(self, worker: str):
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO workers (name, heartbeat) VALUES (?, ?)", (worker, now))
+        self._execute("UPDATE jobs SET heartbeat = ? WHERE worker = ? AND status IN ('running', 'merging')",
+                      (now, worker))
+
+    def retire(self, worker: str):
+        self._execute("DELETE FROM workers WHERE name = ?", (worker,))
+
+    def worker_alive(self) -> bool:
+        cutoff = time.time() - WORKER_STALE_SECONDS
+        return bool(self._execute("SELECT 1 FROM workers WHERE heartbeat > ? LIMIT 1", (cutoff,)))
+
+    def requeue_stale(self) -> int:
+        """Queues again the running jobs of workers that stopped (crash, kill, reboot)."""
+        rows = self._execute("UPDATE jobs SET status = 'queued', worker = NULL "
+                             "WHERE status IN ('running', 'merging') AND heartbeat < ? RETURNING id",
+                             (time.time() - WORKER_STALE_SECONDS,))
+        return len(rows)
+
+
+def eta(job: dict):
+    """Seconds left for a running job at its average pace so far, or None before the first page."""
+    done, total = job["pages_done"], job["pages_total"]
+    if job["status"] != "running" or not done or not total:
+        return None
+    return (time.time() - job["started"]) / done * (total - done)
+
+
+def ensure_worker(queue: JobQueue = None) -> bool:
+    """Starts a detached worker process unless a live one exists; True if one was started."""
+    queue = queue or JobQueue()
+    if queue.worker_alive():
+        return False
+    WORKER_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(WORKER_LOG_PATH, "a") as log:
+        subprocess.Popen([sys.executable, "-u", str(Path(__file__).resolve())], stdin=subprocess.DEVNULL,
+                         stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    return True
+
+
+def _warm_pages(co, cache, queue: JobQueue, job: dict) -> list:
+    """Rasterizes the job's PDF and embeds its pages into the shared cache; returns the page paths."""
+    from pdf2image import pdfinfo_from_path
+    from utils import iter_pdf_pages
+    from embed_scheduler import embed_pages
+    from page_dedup import PageDeduper
+
+    total = pdfinfo_from_path(job["pdf_path"])["Pages"]
+    queue.progress(job["id"], 0, total)
+    pages = []
+
+    def rendered():
+        for path in iter_pdf_pages(job["pdf_path"], IMG_FOLDER):
+            pages.append(path)
+            yield path
+
+    # A private copy of the dedup state skips known duplicates; the merge decides for good
+    deduper = PageDeduper() if DEDUP_PAGES else None
+    aliased = len(deduper.aliases) if deduper else 0
+    stream = deduper.filter(rendered()) if deduper else rendered()
+    embedded = []
+    # Progress counts embedded pages (plus skipped duplicates), not pages rendered ahead of the embedder
+    for path, _ in embed_pages(co, stream, cache=cache):
+        embedded.append(path)
+        skipped = len(deduper.aliases) - aliased if deduper else 0
+        queue.progress(job["id"], len(embedded) + skipped)
+    queue.progress(job["id"], len(pages))
+    if TILE_MODE:
+        from image_prep import make_tiles
+        tiles = (tile for page in embedded for tile, _ in make_tiles(page))
+        for _ in embed_pages(co, tiles, cache=cache):
+            pass
+    cache.flush()
+    return pages
+
+
+def _run_job(cache, queue: JobQueue, job: dict):
+    from config import get_cohere_client
+    from faiss_utils import load_manifest
+    from pdf_processing_embedding import process_pdfs_and_embed_pages
+
+    pdf_path = Path(job["pdf_path"])
+    print(f"🛠️ Job {job['id']}: {pdf_path.name}")
+    try:
+        co = get_cohere_client()  # a missing API key fails the job, where the app shows it
+        pages = _warm_pages(co, cache, queue, job)
+        queue.merging(job["id"])
+        # Every page is now a cache hit, so the merge holds the index lock only briefly
+        manifest = process_pdfs_and_embed_pages(co, pdf_path, cache=cache, rendered_pages=pages)
+        # None when the PDF was already indexed (e.g. by another job): any current generation has it
+        generation = (manifest or load_manifest())["generation"]
+        queue.finish(job["id"], generation)
+        print(f"✅ Job {job['id']}: {pdf_path.name} published in generation {generation}")
+    except Exception as e:
+        traceback.print_exc()
+        queue.fail(job["id"], f"{type(e).__name__}: {e}")
+
+
+def run_worker(concurrency: int = INGEST_CONCURRENCY, once: bool = False):
+    """Claims and runs jobs until stopped (or, with `once`, until the queue is empty)."""
+    import fcntl
+    from concurrent.futures import ThreadPoolExecutor
+    from config import ensure_folders
+    from embedding_cache import EmbeddingCache
+
+    ensure_folders()
+    WORKER_LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    lock = open(WORKER_LOCK_PATH, "a")
+    try:
+        # One worker per store; its threads share one embedding cache
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("⚠️ Another ingestion worker is already running")
+        return
+
+    cache, queue = EmbeddingCache(), JobQueue()
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"👷 Ingestion worker {name} started ({concurrency} concurrent PDFs)")
+    running = set()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ingest") as pool:
+            while True:
+                queue.heartbeat(name)
+                if requeued := queue.requeue_stale():
+                    print(f"🔁 Requeued {requeued} jobs of a stopped worker")
+                running = {future for future in running if not future.done()}
+                while len(running) < concurrency and (job := queue.claim(name)):
+                    running.add(pool.submit(_run_job, cache, queue, job))
+                if once and not running:
+                    break
+                time.sleep(INGEST_POLL_SECONDS)
+    finally:
+        queue.retire(name)  # lets the app start a new worker at once
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDFs to queue first")
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+    args = parser.parse_args()
+
+    from utils import hash_file
+    for pdf in args.pdfs:
+        print(f"📥 Queued {pdf} as job {JobQueue().enqueue(pdf, hash_file(pdf))}")
+    run_worker(args.concurrency, args.once)
@@ -0,0 +1,157 @@
+"""
+Near-duplicate page detection with perceptual hashes.
+
+Every page gets a 64-bit pHash (sign of the low-frequency DCT of a 32x32 grayscale) and
+a 256-bit dHash (horizontal gradients of a 17x16 grayscale), computed from its gallery
+thumbnail for a whole batch of pages at once. A page within DEDUP_PHASH_DISTANCE and
+DEDUP_DHASH_DISTANCE bits of an indexed page becomes an alias of that representative:
+it is not embedded and does not take a retrieval slot. Hashes and aliases are kept in
+DEDUP_PATH.
+"""
+import json
+import threading
+import numpy as np
+from pathlib import Path
+from itertools import islice
+from utils import atomic_write
+from image_prep import make_thumbnail
+from config import DEDUP_PATH, DEDUP_PHASH_DISTANCE, DEDUP_DHASH_DISTANCE, IMG_FOLDER
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype="uint16")
+_n = np.arange(32)
+_DCT = np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / 64).astype("float32")
+
+
+def _grayscale(img_path: str, size: tuple):
+    from PIL import Image
+    with Image.open(make_thumbnail(img_path)) as img:
+        img.draft("L", (size[0] * 4, size[1] * 4))  # JPEG thumbnails decode at reduced scale
+        return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype="float32")
+
+
+def perceptual_hashes(img_paths: list):
+    """(phash, dhash) as packed uint8 arrays of shape (n, 8) and (n, 32)."""
+    small = np.stack([_grayscale(p, (32, 32)) for p in img_paths])
+    low = (_DCT @ small @ _DCT.T)[:, :8, :8].reshape(len(img_paths), 64)
+    phash = low > np.median(low[:, 1:], axis=1, keepdims=True)  # DC term excluded from the median
+
+    grid = np.stack([_grayscale(p, (17, 16)) for p in img_paths])
+    dhash = (grid[:, :, 1:] > grid[:, :, :-1]).reshape(len(img_paths), 256)
+    return np.packbits(phash, axis=1), np.packbits(dhash, axis=1)
+
+
+def hamming(a, b):
+    """Bit distances between packed hashes, broadcasting over leading dimensions."""
+    return _POPCOUNT[np.bitwise_xor(a, b)].sum(axis=-1)
+
+
+def _unpack(hex_hashes: list, n_bytes: int):
+    return np.frombuffer(bytes.fromhex("".join(hex_hashes)), dtype="uint8").reshape(-1, n_bytes).copy()
+
+
+class PageDeduper:
+    """Representatives' hashes plus the alias map {duplicate page: representative page}."""
+
+    def __init__(self, path: Path = DEDUP_PATH):
+        self.path = Path(path)
+        data = {"hashes": {}, "aliases": {}}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        self.hashes = data["hashes"]  # page -> [phash hex, dhash hex], representatives only
+        self.aliases = data["aliases"]
+        self._rebuild()
+
+    def _rebuild(self):
+        self.reps = list(self.hashes)
+        self._phash = _unpack([h[0] for h in self.hashes.values()], 8)
+        self._dhash = _unpack([h[1] for h in self.hashes.values()], 32)
+
+    def ensure_hashes(self, page_names: list, batch_size: int = 64):
+        """Hashes indexed pages stored before deduplication existed, so new pages are compared to them."""
+        missing = [n for n in page_names if n not in self.hashes and n not in self.aliases
+                   and (IMG_FOLDER / n).exists()]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            phash, dhash = perceptual_hashes([str(IMG_FOLDER / n) for n in batch])
+            for name, p, d in zip(batch, phash, dhash):
+                self.hashes[name] = [p.tobytes().hex(), d.tobytes().hex()]
+        if missing:
+            self._rebuild()
+
+    def _match(self, phash, dhash):
+        if not self.reps:
+            return None
+        close = ((hamming(self._phash, phash) <= DEDUP_PHASH_DISTANCE)
+                 & (hamming(self._dhash, dhash) <= DEDUP_DHASH_DISTANCE))
+        hits = np.flatnonzero(close)
+        return self.reps[hits[0]] if len(hits) else None
+
+    def filter(self, img_paths, batch_size: int = 16):
+        """Yields the paths of pages that need embedding; near-duplicates are recorded as aliases."""
+        iterator = iter(img_paths)
+        while batch := list(islice(iterator, batch_size)):
+            phashes, dhashes = perceptual_hashes(batch)
+            for img_path, phash, dhash in zip(batch, phashes, dhashes):
+                name = Path(img_path).name
+                representative = self._match(phash, dhash)
+                if representative is not None and representative != name:
+                    self.aliases[name] = representative
+                    continue
+                self.hashes[name] = [phash.tobytes().hex(), dhash.tobytes().hex()]
+                self.reps.append(name)
+                self._phash = np.vstack([self._phash, phash])
+                self._dhash = np.vstack([self._dhash, dhash])
+                yield img_path
+
+    def forget(self, page_names) -> list:
+        """
+        Drops pages that are about to be removed from the index. A removed representative
+        with surviving duplicates hands over to the first of them; returns those
+        (old representative, new representative) pairs so the caller can move the vector.
+        """
+        page_names = set(page_names)
+        for name in page_names:
+            self.aliases.pop(name, None)
+        promotions = []
+        for name in page_names:
+            hashes = self.hashes.pop(name, None)
+            if hashes is None:
+                continue
+            group = sorted(dup for dup, rep in self.aliases.items() if rep == name)
+            if group:
+                new_rep = group[0]
+                promotions.append((name, new_rep))
+                self.hashes[new_rep] = hashes  # within the thresholds of its own hashes
+                del self.aliases[new_rep]
+                for dup in group[1:]:
+                    self.aliases[dup] = new_rep
+        self._rebuild()
+        return promotions
+
+    def pages_of(self, pdf_name: str) -> set:
+        prefix = f"{pdf_name}_page"
+        return {n for n in (*self.hashes, *self.aliases) if n.startswith(prefix)}
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_write(self.path, "w") as f:
+            json.dump({"hashes": self.hashes, "aliases": self.aliases}, f)
+
+
+_lock = threading.Lock()
+_cached = None  # (mtime, aliases)
+
+
+def get_aliases() -> dict:
+    """{duplicate page: representative page}, reloaded when DEDUP_PATH changes."""
+    global _cached
+    try:
+        mtime = DEDUP_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _lock:
+        if _cached is None or _cached[0] != mtime:
+            with open(DEDUP_PATH, "r") as f:
+                _cached = (mtime, json.load(f)["aliases"])
+        return _cached[1]
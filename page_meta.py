@@ -0,0 +1,111 @@
+"""
+Structured metadata of the pages in an index: document, year, page number and ingestion time.
+
+Each published index generation carries a columnar table (page_meta.N.npz) aligned with its
+filename list. Searches take `filters` over it, e.g.
+
+    search_image_by_question(question, co, filters={"years": [2023], "pages": [1, 40]})
+
+with any of "documents" (names without .pdf), "years" and "pages" (inclusive first, last).
+"""
+import re
+import time
+import numpy as np
+
+FILTER_KEYS = ("documents", "years", "pages")
+
+_PAGE_NAME = re.compile(r"^(?P<document>.+?)_page(?P<page>\d+)")
+_YEAR = re.compile(r"(?<!\d)(?:19|20)\d{2}(?!\d)")
+
+
+def parse_page_name(name: str) -> tuple:
+    """("2022TrustFundAnnualReports", 19) for "2022TrustFundAnnualReports_page19.png" (or a tile of it)."""
+    match = _PAGE_NAME.match(name)
+    return (match["document"], int(match["page"])) if match else (name.rsplit(".", 1)[0], 0)
+
+
+def document_year(document: str) -> int:
+    """Report year taken from the document name; 0 when it has none."""
+    match = _YEAR.search(document)
+    return int(match.group()) if match else 0
+
+
+def build_page_meta(filenames: list, ingested: dict = None, default_time: float = None) -> dict:
+    """
+    Columns {"documents", "years", "ingested_at"} per document and {"doc", "page"} per row.
+    `ingested` keeps known ingestion times; other documents get `default_time` (now).
+    """
+    ingested = ingested or {}
+    default_time = time.time() if default_time is None else default_time
+    parsed = [parse_page_name(name) for name in filenames]
+    documents = sorted({document for document, _ in parsed})
+    doc_ids = {document: i for i, document in enumerate(documents)}
+    return {
+        "documents": np.array(documents, dtype="U"),
+        "years": np.array([document_year(d) for d in documents], dtype="int16"),
+        "ingested_at": np.array([ingested.get(d, default_time) for d in documents], dtype="float64"),
+        "doc": np.array([doc_ids[d] for d, _ in parsed], dtype="int32"),
+        "page": np.array([page for _, page in parsed], dtype="int32"),
+    }
+
+
+def ingestion_times(meta: dict) -> dict:
+    return dict(zip(meta["documents"].tolist(), meta["ingested_at"].tolist()))
+
+
+def check_filters(filters: dict):
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown search filters: {sorted(unknown)}; expected {FILTER_KEYS}")
+    if filters.get("pages") is not None and len(filters["pages"]) != 2:
+        raise ValueError("The pages filter is an inclusive [first, last] range")
+
+
+def match_rows(meta: dict, filters: dict):
+    """Boolean mask of the rows that satisfy every given filter."""
+    doc_ok = np.ones(len(meta["documents"]), dtype=bool)
+    if filters.get("documents"):
+        doc_ok &= np.isin(meta["documents"], [str(d).removesuffix(".pdf") for d in filters["documents"]])
+    if filters.get("years"):
+        doc_ok &= np.isin(meta["years"], [int(y) for y in filters["years"]])
+    mask = doc_ok[meta["doc"]]
+    if filters.get("pages"):
+        first, last = filters["pages"]
+        mask &= (meta["page"] >= int(first)) & (meta["page"] <= int(last))
+    return mask
+
+
+class PageSelection:
+    """
+    Rows of a page index that satisfy a filter, and the page name each is reported under.
+    A deduplicated page (see page_dedup) only has a row under its representative, so a
+    representative whose alias matches the filter is selected and reported as that alias.
+    """
+
+    def __init__(self, meta: dict, filenames: list, filters: dict, aliases: dict = None):
+        check_filters(filters)
+        self.filters = filters
+        self.aliases = aliases or {}
+        self.names = {int(i): filenames[i] for i in np.flatnonzero(match_rows(meta, filters))}
+        self._row_of = {}
+        if self.aliases:
+            self._row_of = {name: i for i, name in enumerate(filenames)}
+            duplicates = sorted(self.aliases)
+            matched = match_rows(build_page_meta(duplicates, default_time=0.0), filters)
+            for duplicate in np.array(duplicates, dtype=object)[matched]:
+                row = self._row_of.get(self.aliases[duplicate])
+                if row is not None:
+                    self.names.setdefault(row, duplicate)
+        self.ids = np.array(sorted(self.names), dtype="int64")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def name(self, row: int) -> str:
+        return self.names[int(row)]
+
+    def canonical(self, name: str):
+        """Name under which a page-text hit that passed the filter is reported."""
+        representative = self.aliases.get(name, name)
+        row = self._row_of.get(representative)
+        return self.names.get(row, representative) if row is not None else representative
@@ -1,16 +1,44 @@
-from config import HASHES_FOLDER, PDF_HASH_FILE, PDF_FOLDER, IMG_FOLDER
-from utils import load_json, hash_file, convert_pdf_to_images, embed_image, save_json
-from faiss_utils import load_faiss_index, save_faiss_index, add_embedding
+from config import (HASHES_FOLDER, PDF_HASH_FILE, PDF_FOLDER, IMG_FOLDER, CHECKPOINT_PAGES, TILE_MODE,
+                    DEDUP_PAGES, INGEST_LOCK_PATH, ensure_folders)
+from utils import load_json, hash_file, iter_pdf_pages, save_json, file_lock
+from embed_scheduler import embed_pages
+from faiss_utils import load_faiss_index, save_faiss_index, add_embedding, remove_embeddings
+from embedding_cache import EmbeddingCache
+from answer_cache import AnswerCache
+from text_index import index_pdf
+from tiles import embed_pdf_tiles, tiles_of_pages
+from page_dedup import PageDeduper
 from pathlib import Path
 from tqdm import tqdm
 import os
 
-def process_pdfs_and_embed_pages(co, specific_pdf_path: Path = None):
+def process_pdfs_and_embed_pages(co, specific_pdf_path: Path = None, cache: EmbeddingCache = None,
+                                 rendered_pages: list = None):
+    """
+    Embeds new or changed PDFs. Each finished PDF is published as a new index generation
+    before its hash is recorded, and the embedding cache is flushed every CHECKPOINT_PAGES
+    pages, so an interrupted run resumes by re-reading cached embeddings, not re-embedding.
+    `rendered_pages` are page images of specific_pdf_path already rasterized by the caller.
+    Returns the manifest of the last generation published, or None when nothing changed.
+    """
+    ensure_folders()
+    # Index updates are read-modify-write: one ingestion at a time, across processes
+    with file_lock(INGEST_LOCK_PATH):
+        return _process_pdfs(co, specific_pdf_path, cache or EmbeddingCache(), rendered_pages)
+
+
+def _process_pdfs(co, specific_pdf_path, cache, rendered_pages):
     pdf_hash_path = os.path.join(HASHES_FOLDER, PDF_HASH_FILE)
     pdf_hashes = load_json(pdf_hash_path)
 
     index, filenames = load_faiss_index()
+    answer_cache = AnswerCache()
+    deduper = PageDeduper()
+    if DEDUP_PAGES:
+        deduper.ensure_hashes(filenames)  # pages indexed before deduplication existed
     new_embeddings = 0
+    duplicates = 0
+    manifest = None
 
     pdf_files = [specific_pdf_path] if specific_pdf_path else [
         os.path.join(PDF_FOLDER, f)
@@ -28,22 +56,45 @@ def process_pdfs_and_embed_pages(co, specific_pdf_path: Path = None):
             continue
 
         print(f"🔄 Processing: {pdf_path.name}")
-        image_paths = convert_pdf_to_images(pdf_path, IMG_FOLDER)
-
-        for img_path in image_paths:
-            img_name = os.path.basename(img_path)
+        # The PDF changed: drop its old pages, then re-add every page. Pages whose rendered
+        # bytes are unchanged come straight from the embedding cache.
+        old_pages = [f for f in filenames if f.startswith(f"{pdf_name}_page")]
+        # Pages of other PDFs aliased to one of ours keep their vector under a new representative
+        for old_rep, new_rep in deduper.forget(set(old_pages) | deduper.pages_of(pdf_name)):
+            vector = index.reconstruct(filenames.index(old_rep))
+            add_embedding(index, filenames, vector, new_rep)
+        remove_embeddings(index, filenames, old_pages)
+        answer_cache.invalidate_pages(old_pages + tiles_of_pages(old_pages))
 
-            if img_name in filenames:
-                continue
-
-            emb = embed_image(co, img_path)
-            add_embedding(index, filenames, emb, img_name)
+        # Pages stream out of the rasterizer, so embedding starts before the whole PDF is rendered
+        pages = rendered_pages if rendered_pages is not None else iter_pdf_pages(pdf_path, IMG_FOLDER)
+        if DEDUP_PAGES:
+            aliased = len(deduper.aliases)
+            pages = deduper.filter(pages)
+        page_paths = []
+        for img_path, emb in embed_pages(co, pages, cache=cache):
+            add_embedding(index, filenames, emb, os.path.basename(img_path))
+            page_paths.append(img_path)
             new_embeddings += 1
+            if new_embeddings % CHECKPOINT_PAGES == 0:
+                cache.flush()
 
+        cache.flush()
+        deduper.save()
+        manifest = save_faiss_index(index, filenames, refreshed=[pdf_name])
+        index_pdf(pdf_path)  # page text for the lexical half of hybrid search
+        if TILE_MODE:
+            tiles = embed_pdf_tiles(co, pdf_name, page_paths, cache)
+            print(f"🧩 Embedded {tiles} tiles of {pdf_path.name}")
         pdf_hashes[pdf_name] = current_hash
-
-    save_faiss_index(index, filenames)
-    save_json(pdf_hash_path, pdf_hashes)
+        save_json(pdf_hash_path, pdf_hashes)
+        if DEDUP_PAGES and len(deduper.aliases) > aliased:
+            duplicates += len(deduper.aliases) - aliased
+            print(f"♻️ {len(deduper.aliases) - aliased} near-duplicate pages aliased instead of embedded")
+        print(f"💾 Published index generation {manifest['generation']} ({index.ntotal} pages)")
 
     print(f"\n✅ Total FAISS entries: {index.ntotal}")
-    print(f"🆕 New embeddings added: {new_embeddings}")
+    print(f"🆕 Pages (re)indexed: {new_embeddings}")
+    if duplicates:
+        print(f"♻️ Near-duplicate pages skipped: {duplicates}")
+    return manifest
@@ -0,0 +1,103 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from config import (MODEL_NAME, EMBED_DIM, CACHE_DB_PATH, QUERY_CACHE_MAX_ITEMS,
+                    QUERY_CACHE_MAX_DISK_ITEMS, QUERY_CACHE_TTL, QUERY_CACHE_PERSIST)
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Query embeddings keyed by normalized question text plus model: an in-memory LRU in
+    front of an optional SQLite table. Entries older than `ttl` seconds are treated as
+    misses, and the table is trimmed to `max_disk_items` by last use.
+    """
+
+    def __init__(self, db_path=CACHE_DB_PATH, max_items: int = QUERY_CACHE_MAX_ITEMS,
+                 max_disk_items: int = QUERY_CACHE_MAX_DISK_ITEMS, ttl: float = QUERY_CACHE_TTL,
+                 persist: bool = QUERY_CACHE_PERSIST, model: str = MODEL_NAME, dim: int = EMBED_DIM):
+        self.db_path = db_path
+        self.max_items = max_items
+        self.max_disk_items = max_disk_items
+        self.ttl = ttl
+        self.persist = persist
+        self.namespace = f"{model}:{dim}"
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (created, embedding)
+        self._lock = threading.Lock()
+        self._db = None
+        self._puts = 0
+
+    def _conn(self):
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, embedding BLOB, created REAL, last_used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)")
+        return self._db
+
+    def key(self, question: str) -> str:
+        return hashlib.sha256(f"{self.namespace}\n{normalize_question(question)}".encode()).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._memory.pop(key, None)
+
+            if self.persist:
+                db = self._conn()
+                row = db.execute("SELECT embedding, created FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    db.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (now, key))
+                    db.commit()
+                    embedding = np.frombuffer(row[0], dtype="float32")
+                    self._remember(key, row[1], embedding)
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, embedding):
+        embedding = np.asarray(embedding, dtype="float32")
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, embedding)
+            if self.persist:
+                db = self._conn()
+                db.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                           (key, embedding.tobytes(), now, now))
+                self._puts += 1
+                if self._puts % 100 == 0:  # trimming scans the table, so only do it now and then
+                    db.execute(
+                        "DELETE FROM query_embeddings WHERE created < ? OR key IN ("
+                        "SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (now - self.ttl, self.max_disk_items),
+                    )
+                db.commit()
+
+    def _remember(self, key, created, embedding):
+        self._memory[key] = (created, embedding)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "memory_items": len(self._memory)}
@@ -0,0 +1,327 @@
+"""
+Shared resilience layer for every outbound API call.
+
+    embed_endpoint.call(co.embed, tokens=n_tokens, idempotent=True, model=..., inputs=...)
+
+Each Endpoint combines a token-bucket rate limit shared by all threads, retries with
+full-jitter exponential backoff that honour 429 Retry-After (pausing the whole endpoint),
+a circuit breaker that fails fast while the service is down, and, for idempotent calls,
+a hedged second request when the first is slower than the recent latency percentile.
+Client errors (400, 401, 404, ...) are raised at once rather than retried.
+"""
+import time
+import random
+import threading
+import functools
+import numpy as np
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (EMBED_RPM, EMBED_TPM, LLM_RPM, RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                    BREAKER_FAILURES, BREAKER_RESET, HEDGE_PERCENTILE, HEDGE_MIN_DELAY,
+                    API_WORKER_THREADS, EMBED_MAX_WORKERS, INGEST_CONCURRENCY)
+
+RETRYABLE_STATUS = {408, 409, 425, 429}
+PROGRAMMING_ERRORS = (TypeError, ValueError, KeyError, AttributeError, NotImplementedError)
+HEDGE_MIN_SAMPLES = 20  # latency samples needed before hedging
+
+# Room for every concurrent caller (API threads, ingestion embed workers) plus their hedges.
+# A call that finds the pool full runs on its own thread without a hedge, so neither the
+# call nor a hedge ever waits in the pool's queue.
+HEDGE_POOL_SIZE = 2 * (API_WORKER_THREADS + EMBED_MAX_WORKERS * INGEST_CONCURRENCY)
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_POOL_SIZE)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def status_code(exc: Exception):
+    """HTTP status of an SDK (Cohere, OpenAI) or urllib error, or None for network errors."""
+    for source in (exc, getattr(exc, "response", None)):
+        for attr in ("status_code", "status", "code"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def retry_after(exc: Exception):
+    """Seconds requested by a Retry-After (or retry-after-ms) header on the error, if any."""
+    for source in (exc, getattr(exc, "response", None)):
+        headers = getattr(source, "headers", None)
+        if not headers:
+            continue
+        headers = {str(k).lower(): v for k, v in dict(headers).items()}
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                value = headers["retry-after"]
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (CircuitOpenError, *PROGRAMMING_ERRORS)):
+        return False
+    status = status_code(exc)
+    return status is None or status in RETRYABLE_STATUS or status >= 500
+
+
+class TokenBucket:
+    """Thread-safe token bucket; `pause()` holds every caller back, e.g. after a 429."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self, tokens: float) -> float:
+        """Takes the tokens and returns 0, or returns how long to wait for them."""
+        now = time.monotonic()
+        if now < self._resume_at:
+            return self._resume_at - now
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._level >= tokens:
+            self._level -= tokens
+            return 0.0
+        return (tokens - self._level) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                wait_for = self._take(tokens)
+            if not wait_for:
+                return
+            time.sleep(max(wait_for, 0.01))
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self._lock:
+            return not self._take(min(tokens, self.capacity))
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets; either limit may be 0 (unlimited)."""
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, burst_seconds: float = 10.0):
+        self.requests = TokenBucket(rpm / 60, max(1.0, rpm / 60 * burst_seconds)) if rpm else None
+        self.tokens = TokenBucket(tpm / 60, max(1.0, tpm / 60 * burst_seconds)) if tpm else None
+
+    def _buckets(self, tokens):
+        if self.requests:
+            yield self.requests, 1
+        if self.tokens and tokens:
+            yield self.tokens, tokens
+
+    def acquire(self, tokens: int = 0):
+        for bucket, amount in self._buckets(tokens):
+            bucket.acquire(amount)
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        # Hedges only: a partial take just costs a little budget
+        return all(bucket.try_acquire(amount) for bucket, amount in self._buckets(tokens))
+
+    def pause(self, seconds: float):
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                bucket.pause(seconds)
+
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive failures; after `reset_after` seconds lets one probe through."""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._probing else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self._opened_at >= self.reset_after:
+                self._probing = True
+                return True
+            return False
+
+    def remaining(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_after - (time.monotonic() - self._opened_at))
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class Endpoint:
+    """Rate limit, retries, circuit breaker and hedging for one remote API."""
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0, retries: int = RETRY_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY,
+                 breaker: CircuitBreaker = None, hedge: bool = False):
+        self.name = name
+        self.limiter = RateLimiter(rpm, tpm)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge = hedge and HEDGE_MIN_DELAY >= 0
+        self._latencies = deque(maxlen=200)
+        self._stats = {"calls": 0, "retries": 0, "hedges": 0, "failures": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "state": self.breaker.state}
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: uniform over [0, min(max_delay, base_delay * 2**attempt)]."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def hedge_delay(self):
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = np.array(self._latencies)
+        return max(HEDGE_MIN_DELAY, float(np.percentile(samples, HEDGE_PERCENTILE)))
+
+    def _timed(self, fn, args, kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return result
+
+    def _submit(self, fn, args, kwargs, started: threading.Event = None):
+        """Runs a call on the hedge pool, or returns None when every pool thread is taken."""
+        if not _hedge_slots.acquire(blocking=False):
+            return None
+
+        def run():
+            if started is not None:
+                started.set()
+            return self._timed(fn, args, kwargs)
+
+        future = _hedge_pool.submit(run)
+        future.add_done_callback(lambda _: _hedge_slots.release())
+        return future
+
+    def _hedged(self, fn, args, kwargs, tokens):
+        delay = self.hedge_delay()
+        started = threading.Event()
+        primary = self._submit(fn, args, kwargs, started) if delay is not None else None
+        if primary is None:
+            return self._timed(fn, args, kwargs)
+
+        # The hedge deadline counts from when the call starts, not from when it was queued
+        started.wait()
+        futures = {primary}
+        done, _ = wait(futures, timeout=delay)
+        if not done and self.limiter.try_acquire(tokens):
+            hedge = self._submit(fn, args, kwargs)
+            if hedge is not None:
+                self._count("hedges")
+                futures.add(hedge)
+
+        error = None
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()  # the slower request finishes in the background
+                error = future.exception()
+        raise error
+
+    def call(self, fn, *args, tokens: int = 0, idempotent: bool = False, **kwargs):
+        """Calls fn(*args, **kwargs) under this endpoint's policies; raises the last error."""
+        self._count("calls")
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError(f"{self.name} circuit open; retry in {self.breaker.remaining():.0f}s")
+            self.limiter.acquire(tokens)
+            try:
+                if idempotent and self.hedge:
+                    result = self._hedged(fn, args, kwargs, tokens)
+                else:
+                    result = self._timed(fn, args, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.success()  # the service answered; the request was at fault
+                    raise
+                self.breaker.failure()
+                self._count("failures")
+                if attempt == self.retries or self.breaker.state == "open":
+                    raise
+
+                requested = retry_after(e)
+                if requested is not None:
+                    delay = min(requested, self.max_delay * 4)
+                    self.limiter.pause(delay)  # every thread backs off, not just this one
+                else:
+                    delay = self.backoff(attempt)
+                self._count("retries")
+                print(f"🔁 {self.name} attempt {attempt + 1} failed — retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+            else:
+                self.breaker.success()
+                return result
+
+
+def resilient(endpoint: Endpoint, idempotent: bool = False):
+    """Decorator form of Endpoint.call()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return endpoint.call(fn, *args, idempotent=idempotent, **kwargs)
+        return wrapper
+    return decorator
+
+
+# One endpoint per remote API, shared by every caller in the process
+embed_endpoint = Endpoint("cohere_embed", rpm=EMBED_RPM, tpm=EMBED_TPM, hedge=True)
+chat_endpoint = Endpoint("openai_chat", rpm=LLM_RPM)
+rag_api_endpoint = Endpoint("rag_api")
+
+
+def endpoint_stats() -> dict:
+    return {e.name: e.stats() for e in (embed_endpoint, chat_endpoint, rag_api_endpoint)}
@@ -0,0 +1,93 @@
+import sys
+import pickle
+from pathlib import Path
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs a test from an empty folder: config paths (store/, images/, static/) are relative.
+    Module-level caches (query and answer caches, loaded indexes) are replaced so that
+    none keeps another test's database or store.
+    """
+    import embeddings
+    import faiss_utils
+    import vision_query
+    from query_cache import QueryEmbeddingCache
+    from answer_cache import AnswerCache
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(embeddings, "query_cache", QueryEmbeddingCache())
+    monkeypatch.setattr(vision_query, "answer_cache", AnswerCache())
+    for cache in ("_cached_indexes", "_cached_meta", "_vectors_cache"):
+        monkeypatch.setattr(faiss_utils, cache, {})
+    return tmp_path
+
+
+@pytest.fixture
+def legacy_store(workdir):
+    """
+    A store as written before manifests and vectors files existed: a flat index and the
+    filename list over three small reports, with their page images. Returns (filenames, vectors).
+    """
+    import faiss
+    from PIL import Image
+    from config import EMBED_DIM, FAISS_INDEX_PATH, FILENAME_MAP_PATH, IMG_FOLDER
+
+    filenames = [f"{year}AnnualReport_page{page}.png" for year in (2021, 2022, 2023) for page in range(1, 6)]
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(filenames), EMBED_DIM)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = faiss.IndexFlatIP(EMBED_DIM)
+    index.add(vectors)
+    FAISS_INDEX_PATH.parent.mkdir(parents=True)
+    faiss.write_index(index, str(FAISS_INDEX_PATH))
+    with open(FILENAME_MAP_PATH, "wb") as f:
+        pickle.dump(filenames, f)
+    IMG_FOLDER.mkdir()
+    for i, name in enumerate(filenames):
+        Image.new("RGB", (60, 80), (i * 16, 255 - i * 16, 128)).save(IMG_FOLDER / name)
+    return filenames, vectors
+
+
+@pytest.fixture
+def fake_pdfs(workdir, monkeypatch):
+    """
+    Poppler is not needed: a "PDF" in source_docs/ is a JSON list of pages, each
+    {"seed", "text"}. Pages with the same seed render to identical images. Returns
+    make_pdf(name, pages) -> path.
+    """
+    import json
+    import pdf2image
+    import utils
+    import text_index
+    import pdf_processing_embedding
+    from PIL import Image
+    from config import PDF_FOLDER
+
+    def make_pdf(name: str, pages: list) -> Path:
+        PDF_FOLDER.mkdir(exist_ok=True)
+        path = PDF_FOLDER / f"{name}.pdf"
+        path.write_text(json.dumps(pages))
+        return path
+
+    def pages_of(pdf_path):
+        return json.loads(Path(pdf_path).read_text())
+
+    def iter_pdf_pages(pdf_path, output_dir, **kwargs):
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        for number, page in enumerate(pages_of(pdf_path), start=1):
+            pixels = np.random.default_rng(page["seed"]).integers(0, 256, (40, 30, 3), dtype="uint8")
+            out_path = Path(output_dir) / f"{Path(pdf_path).stem}_page{number}.png"
+            Image.fromarray(pixels).resize((300, 400), Image.NEAREST).save(out_path)
+            yield str(out_path)
+
+    monkeypatch.setattr(pdf2image, "pdfinfo_from_path", lambda path, **kwargs: {"Pages": len(pages_of(path))})
+    monkeypatch.setattr(utils, "iter_pdf_pages", iter_pdf_pages)
+    monkeypatch.setattr(pdf_processing_embedding, "iter_pdf_pages", iter_pdf_pages)
+    monkeypatch.setattr(text_index, "extract_page_texts", lambda path: [p["text"] for p in pages_of(path)])
+    return make_pdf
@@ -0,0 +1,90 @@
+import numpy as np
+import vision_query
+from fake_clients import FakeOpenAI
+
+PAGES = ["images/2022AnnualReport_page3.png", "images/2022AnnualReport_page4.png"]
+
+
+def _near(embedding, seed, scale=0.05):
+    noise = np.random.default_rng(seed).standard_normal(len(embedding)).astype("float32")
+    return embedding + scale * noise / np.linalg.norm(noise)
+
+
+def test_near_duplicate_question_skips_the_llm(legacy_store):
+    _, vectors = legacy_store
+    llm = FakeOpenAI()
+    first = vision_query.answer_question_about_images("What was spent?", PAGES, llm, verbose=False,
+                                                      query_embedding=vectors[0])
+    again = vision_query.answer_question_about_images("what was spent", PAGES[::-1], llm, verbose=False,
+                                                      query_embedding=_near(vectors[0], 1))
+    assert first == again == llm.answer
+    assert llm.calls == 1
+    assert vision_query.answer_cache.stats()["hits"] == 1
+
+
+def test_other_pages_context_or_question_miss(legacy_store):
+    _, vectors = legacy_store
+    llm = FakeOpenAI()
+    ask = vision_query.answer_question_about_images
+    ask("What was spent?", PAGES, llm, verbose=False, query_embedding=vectors[0])
+    ask("What was spent?", PAGES[:1], llm, verbose=False, query_embedding=vectors[0])
+    ask("What was spent?", PAGES, llm, verbose=False, query_embedding=vectors[0],
+        context_cache=[{"question": "Which fund?", "answer": "The trust fund."}])
+    ask("Who approved it?", PAGES, llm, verbose=False, query_embedding=vectors[1])
+    assert llm.calls == 4
+
+
+def test_invalidated_pages_are_answered_again(legacy_store):
+    _, vectors = legacy_store
+    llm = FakeOpenAI()
+    vision_query.answer_question_about_images("What was spent?", PAGES, llm, verbose=False,
+                                              query_embedding=vectors[0])
+    assert vision_query.answer_cache.invalidate_pages(["2022AnnualReport_page4.png"]) == 1
+    vision_query.answer_question_about_images("What was spent?", PAGES, llm, verbose=False,
+                                              query_embedding=vectors[0])
+    assert llm.calls == 2
+
+
+def test_lookups_reload_only_for_answers_written_elsewhere(workdir, monkeypatch):
+    from answer_cache import AnswerCache
+    from query_cache import QueryEmbeddingCache
+    cache, other = AnswerCache(), AnswerCache()
+    reloads = []
+    refresh = AnswerCache._refresh
+
+    def counting_refresh(self):
+        version = self._data_version
+        refresh(self)
+        if self is cache and self._data_version != version:
+            reloads.append(version)
+
+    monkeypatch.setattr(AnswerCache, "_refresh", counting_refresh)
+    vectors = np.eye(4, 8, dtype="float32")
+    cache.store(vectors[0], PAGES, "m", "first")
+    assert cache.lookup(vectors[0], PAGES, "m") == "first"
+    reloads.clear()
+
+    queries = QueryEmbeddingCache()
+    for i in range(5):  # the query cache writes on every new question
+        queries.put(queries.key(f"question {i}"), vectors[1])
+        cache.store(vectors[2], PAGES[:1], "m", f"answer {i}")
+        assert cache.lookup(vectors[0], PAGES, "m") == "first"
+    assert reloads == []
+
+    other.store(vectors[3], PAGES, "m", "from another process")
+    assert cache.lookup(vectors[3], PAGES, "m") == "from another process"
+    assert len(reloads) == 1
+
+
+def test_store_trims_to_max_items(workdir):
+    from answer_cache import AnswerCache
+    cache = AnswerCache(max_items=3)
+    vectors = np.eye(5, 8, dtype="float32")
+    for i, vector in enumerate(vectors):
+        cache.store(vector, PAGES, "m", f"answer {i}")
+    assert cache.lookup(vectors[0], PAGES, "m") is None
+    assert cache.lookup(vectors[4], PAGES, "m") == "answer 4"
+    assert AnswerCache(max_items=3).stats()["items"] == 0  # loaded lazily on first use
+    fresh = AnswerCache(max_items=3)
+    assert fresh.lookup(vectors[2], PAGES, "m") == "answer 2"
+    assert fresh.stats()["items"] == 3
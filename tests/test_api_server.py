@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+import api_server
+from fake_clients import FakeCohere, FakeOpenAI
+
+
+@pytest.fixture
+def api(legacy_store, monkeypatch):
+    llm = FakeOpenAI(answer="one two three four five six seven eight", chunks=4)
+    monkeypatch.setattr(api_server, "get_cohere_client", lambda: FakeCohere())
+    monkeypatch.setattr(api_server, "get_openai_client", lambda: llm)
+    with TestClient(api_server.app) as client:
+        yield client, llm
+
+
+def test_answer_refuses_images_outside_the_index(api, workdir):
+    client, llm = api
+    (workdir / "secret.png").write_bytes(b"not a page")
+    for path in ("secret.png", "images/../secret.png", "/etc/passwd", "images/unknown_page1.png"):
+        response = client.post("/answer", json={"question": "What?", "images": [path]})
+        assert response.status_code == 422, path
+        response = client.post("/answer/stream", json={"question": "What?", "images": [path]})
+        assert response.status_code == 422, path
+    assert llm.calls == 0
+    assert not (workdir / "static").exists() or not any((workdir / "static").rglob("secret*"))
+
+
+def test_answer_accepts_indexed_pages(api):
+    client, llm = api
+    response = client.post("/answer", json={"question": "What?", "images": ["images/2022AnnualReport_page3.png"]})
+    assert response.status_code == 200
+    assert response.json()["answer"] == llm.answer
+
+
+def test_answer_rejects_bad_filters(api):
+    client, _ = api
+    response = client.post("/answer", json={"question": "What?", "filters": {"colour": "red"}})
+    assert response.status_code == 422
+
+
+def test_answer_stream_returns_chunks_in_order(api):
+    client, llm = api
+    with client.stream("POST", "/answer/stream",
+                       json={"question": "What?", "images": ["images/2022AnnualReport_page3.png"]}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = "".join(response.iter_text())
+    assert text == llm.answer
+    assert llm.calls == 1
@@ -0,0 +1,30 @@
+import numpy as np
+from embed_scheduler import embed_pages
+from embedding_cache import EmbeddingCache
+from fake_clients import FakeCohere
+
+
+def test_pages_are_embedded_in_batches_in_input_order(legacy_store):
+    filenames, _ = legacy_store
+    paths = [f"images/{name}" for name in filenames]
+    co = FakeCohere(latency=0.01)
+    results = list(embed_pages(co, iter(paths), batch_size=4, max_workers=2))
+
+    assert [path for path, _ in results] == paths
+    assert co.calls == 4  # 15 pages in batches of 4
+    alone = dict(embed_pages(FakeCohere(), paths[-1:], batch_size=1))
+    assert np.allclose(alone[paths[-1]], dict(results)[paths[-1]])
+
+
+def test_cached_pages_skip_the_api(legacy_store):
+    filenames, _ = legacy_store
+    paths = [f"images/{name}" for name in filenames]
+    cache = EmbeddingCache("store/embed_cache", dim=FakeCohere().dim)
+    co = FakeCohere()
+    first = list(embed_pages(co, paths[:10], batch_size=4, cache=cache))
+    calls = co.calls
+
+    second = list(embed_pages(co, paths, batch_size=4, cache=cache))
+    assert co.calls == calls + 2  # only the two batches holding the 5 new pages
+    for (_, before), (_, after) in zip(first, second):
+        assert np.allclose(before, after)
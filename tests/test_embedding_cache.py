@@ -0,0 +1,58 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import EmbeddingCache
+
+DIM = 8
+
+
+def _vec(seed):
+    return np.random.default_rng(seed).standard_normal(DIM).astype("float32")
+
+
+def test_instances_sharing_a_folder_keep_each_others_entries(tmp_path):
+    a, b = EmbeddingCache(tmp_path, dim=DIM), EmbeddingCache(tmp_path, dim=DIM)
+    a.put("a1", _vec(1))
+    b.put("b1", _vec(2))
+    a.put("a2", _vec(3))
+    assert np.array_equal(b.get("b1"), _vec(2))
+    a.flush()
+    b.flush()
+
+    c = EmbeddingCache(tmp_path, dim=DIM)
+    for key, seed in (("a1", 1), ("b1", 2), ("a2", 3)):
+        assert np.array_equal(c.get(key), _vec(seed)), key
+
+
+def test_compaction_by_another_instance(tmp_path):
+    a = EmbeddingCache(tmp_path, dim=DIM, max_entries=2)
+    b = EmbeddingCache(tmp_path, dim=DIM)
+    for i in range(6):
+        a.put(f"a{i}", _vec(i))
+    b.put("b", _vec(100))  # appended to the file a is about to compact away
+    a.flush()  # evicts down to two entries and compacts
+    assert a.generation == 1
+
+    assert np.array_equal(b.get("b"), _vec(100))
+    b.put("b2", _vec(101))
+    b.flush()
+    c = EmbeddingCache(tmp_path, dim=DIM)
+    assert np.array_equal(c.get("a5"), _vec(5))
+    assert np.array_equal(c.get("b"), _vec(100))
+    assert np.array_equal(c.get("b2"), _vec(101))
+
+
+def test_concurrent_puts_get_distinct_rows(tmp_path):
+    caches = [EmbeddingCache(tmp_path, dim=DIM) for _ in range(4)]
+
+    def fill(n):
+        for i in range(50):
+            caches[n].put(f"{n}-{i}", _vec(n * 1000 + i))
+        caches[n].flush()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(fill, range(4)))
+    merged = EmbeddingCache(tmp_path, dim=DIM)
+    assert len(merged.slots) == 200
+    for n in range(4):
+        for i in range(50):
+            assert np.array_equal(merged.get(f"{n}-{i}"), _vec(n * 1000 + i))
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import faiss_utils
+from config import EMBED_DIM
+
+
+def test_load_refuses_an_index_of_another_dimension(workdir, monkeypatch):
+    vectors = np.eye(3, EMBED_DIM, dtype="float32")
+    filenames = [f"2022Report_page{i}.png" for i in range(1, 4)]
+    faiss_utils.publish_generation(vectors, filenames, faiss_utils.create_index(vectors), "float")
+    faiss_utils.load_search_index()
+
+    monkeypatch.setattr(faiss_utils, "EMBED_DIM", EMBED_DIM // 2)
+    with pytest.raises(ValueError, match="EMBED_DIM"):
+        faiss_utils.load_search_index()
+    with pytest.raises(ValueError, match="EMBED_DIM"):
+        faiss_utils.load_faiss_index()
+
+
+def test_baseline_store_upgrades_to_generation_one(legacy_store):
+    filenames, vectors = legacy_store
+    index, names = faiss_utils.load_faiss_index()
+    assert names == filenames
+    assert np.allclose(faiss_utils.load_vectors(), vectors)
+
+    manifest = faiss_utils.save_faiss_index(index, names)
+    assert manifest["generation"] == 1
+    assert faiss_utils.load_manifest()["files"]["vectors"] == "image_vectors.1.npy"
+    assert np.allclose(faiss_utils.load_vectors(), vectors, atol=1e-6)
+    assert faiss_utils.load_filenames() == filenames
+
+
+def _clustered(n=300, dim=EMBED_DIM, n_queries=8, top_k=5, seed=0):
+    """Vectors plus queries that each sit clearly closest to `top_k` known vectors."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    targets = [rng.choice(n, top_k, replace=False) for _ in range(n_queries)]
+    weights = np.linspace(1.0, 0.6, top_k, dtype="float32")  # distinct scores, so a unique order
+    queries = np.stack([weights @ vectors[t] for t in targets])
+    queries += 0.02 * rng.standard_normal(queries.shape).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+@pytest.mark.parametrize("search_dim", [0, 256])
+@pytest.mark.parametrize("storage", ["float", "int8", "binary"])
+def test_compressed_search_rescored_to_exact_results(workdir, storage, search_dim):
+    vectors, queries = _clustered()
+    top_k = 5
+    filenames = [f"2022Report_page{i}.png" for i in range(1, len(vectors) + 1)]
+    index = faiss_utils.create_index(vectors, "flat", storage, search_dim)
+    faiss_utils.publish_generation(vectors, filenames, index, storage)
+
+    index, _ = faiss_utils.get_faiss_index()
+    assert index.d == (search_dim or EMBED_DIM)
+    D, I = faiss_utils.search_index(index, queries, top_k)
+
+    exact = queries @ vectors.T
+    expected = np.argsort(-exact, axis=1)[:, :top_k]
+    assert np.array_equal(I, expected)
+    # Scores are full-precision cosines, not code distances
+    assert np.allclose(D, np.take_along_axis(exact, expected, axis=1), atol=1e-5)
+    assert (np.abs(D) <= 1 + 1e-5).all()
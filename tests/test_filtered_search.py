@@ -0,0 +1,21 @@
+import numpy as np
+import faiss_utils
+from fake_clients import FakeCohere
+from vision_query import search_images_by_questions
+
+
+def test_filtered_search_on_generation_zero_store(legacy_store):
+    filenames, vectors = legacy_store
+    assert faiss_utils.load_manifest()["generation"] == 0
+
+    index, names = faiss_utils.get_faiss_index()
+    rows = np.arange(5, 10)  # the 2022 report
+    D, I = faiss_utils.search_subset(index, vectors[7], 3, rows)
+    assert I[0][0] == 7
+    assert set(I[0]) <= set(rows)
+
+    results = list(search_images_by_questions(["What was spent?"], FakeCohere(), top_k=3,
+                                              filters={"years": [2022], "pages": [2, 4]}))
+    images = results[0]["images"]
+    assert len(images) == 3
+    assert all("2022AnnualReport_page" in path for path in images)
@@ -0,0 +1,89 @@
+import config
+import embed_scheduler
+import ingest_worker
+from ingest_worker import JobQueue, _run_job
+from embedding_cache import EmbeddingCache
+from faiss_utils import load_manifest, load_filenames
+from fake_clients import FakeCohere
+
+
+class RecordingQueue(JobQueue):
+    """Records each progress report with the number of pages embedded at that moment."""
+
+    def __init__(self, embedded: list):
+        super().__init__()
+        self.embedded = embedded
+        self.reported = []
+
+    def progress(self, job_id, pages_done, pages_total=None):
+        self.reported.append((pages_done, len(self.embedded)))
+        super().progress(job_id, pages_done, pages_total)
+
+
+def _pages(n, start=0):
+    return [{"seed": start + i, "text": f"page {start + i}"} for i in range(n)]
+
+
+def test_job_counts_embedded_pages_and_records_its_generation(fake_pdfs, monkeypatch):
+    co = FakeCohere(latency=0.01)
+    monkeypatch.setattr(config, "get_cohere_client", lambda: co)
+    embedded = []
+    embed_pages = embed_scheduler.embed_pages
+
+    def counting_embed_pages(*args, **kwargs):
+        for result in embed_pages(*args, **kwargs):
+            embedded.append(result)
+            yield result
+
+    monkeypatch.setattr(embed_scheduler, "embed_pages", counting_embed_pages)
+    queue = RecordingQueue(embedded)
+    job_id = queue.enqueue(fake_pdfs("2023Report", _pages(12)), "sha")
+    _run_job(EmbeddingCache(), queue, queue.claim("test"))
+
+    # Reported progress never runs ahead of the embedder
+    assert all(done <= n_embedded for done, n_embedded in queue.reported[:13])
+    assert [done for done, _ in queue.reported][:13] == list(range(13))
+    job = queue.job(job_id)
+    assert job["status"] == "done", job["error"]
+    assert job["generation"] == load_manifest()["generation"] == 1
+    assert len(load_filenames()) == 12
+
+
+def test_published_generation_is_the_jobs_own(fake_pdfs, monkeypatch):
+    import pdf_processing_embedding
+    monkeypatch.setattr(config, "get_cohere_client", lambda: FakeCohere())
+    queue = JobQueue()
+    process = pdf_processing_embedding.process_pdfs_and_embed_pages
+
+    def publish_then_race(*args, **kwargs):
+        manifest = process(*args, **kwargs)
+        process(FakeCohere(), fake_pdfs("2024Other", _pages(3, start=50)))  # another job publishes next
+        return manifest
+
+    monkeypatch.setattr(pdf_processing_embedding, "process_pdfs_and_embed_pages", publish_then_race)
+    job_id = queue.enqueue(fake_pdfs("2023Report", _pages(4)), "sha")
+    _run_job(EmbeddingCache(), queue, queue.claim("test"))
+    assert queue.job(job_id)["generation"] == 1
+    assert load_manifest()["generation"] == 2
+
+
+def test_stale_jobs_are_requeued(workdir, monkeypatch):
+    queue = JobQueue()
+    job_id = queue.enqueue("source_docs/a.pdf", "sha")
+    queue.claim("dead-worker")
+    assert queue.requeue_stale() == 0
+    monkeypatch.setattr(ingest_worker, "WORKER_STALE_SECONDS", -1)
+    assert not queue.worker_alive()
+    assert queue.requeue_stale() == 1
+    assert queue.job(job_id)["status"] == "queued"
+
+
+def test_ensure_worker_only_starts_without_a_live_worker(workdir, monkeypatch):
+    started = []
+    monkeypatch.setattr(ingest_worker.subprocess, "Popen", lambda *args, **kwargs: started.append(args))
+    queue = JobQueue()
+    queue.heartbeat("live")
+    assert not ingest_worker.ensure_worker(queue)
+    monkeypatch.setattr(ingest_worker, "WORKER_STALE_SECONDS", -1)
+    assert ingest_worker.ensure_worker(queue)
+    assert len(started) == 1
@@ -0,0 +1,66 @@
+import numpy as np
+import faiss_utils
+from fake_clients import FakeCohere
+from page_dedup import PageDeduper, get_aliases
+from pdf_processing_embedding import process_pdfs_and_embed_pages
+from vision_query import search_images_by_questions
+
+
+def _search(document):
+    result = next(search_images_by_questions(["What was spent?"], FakeCohere(), top_k=5,
+                                             filters={"documents": [document]}))
+    return sorted(path.rsplit("/", 1)[-1] for path in result["images"])
+
+
+def _index():
+    index, filenames = faiss_utils.load_faiss_index()
+    return index, filenames
+
+
+def test_duplicate_pages_become_aliases(fake_pdfs):
+    co = FakeCohere()
+    process_pdfs_and_embed_pages(co, fake_pdfs("2022A", [{"seed": 1, "text": "a"}, {"seed": 2, "text": "b"}]))
+    process_pdfs_and_embed_pages(co, fake_pdfs("2023B", [{"seed": 2, "text": "b"}, {"seed": 9, "text": "c"}]))
+
+    _, filenames = _index()
+    assert "2023B_page1.png" not in filenames
+    assert get_aliases() == {"2023B_page1.png": "2022A_page2.png"}
+    assert _search("2023B") == ["2023B_page1.png", "2023B_page2.png"]
+
+
+def test_reingesting_a_representative_promotes_its_alias(fake_pdfs):
+    co = FakeCohere()
+    process_pdfs_and_embed_pages(co, fake_pdfs("2022A", [{"seed": 1, "text": "a"}, {"seed": 2, "text": "b"}]))
+    process_pdfs_and_embed_pages(co, fake_pdfs("2023B", [{"seed": 2, "text": "b"}, {"seed": 9, "text": "c"}]))
+    index, filenames = _index()
+    shared_vector = index.reconstruct(filenames.index("2022A_page2.png"))
+
+    # A new version of 2022A without the shared page: 2023B_page1 takes over its vector
+    process_pdfs_and_embed_pages(co, fake_pdfs("2022A", [{"seed": 1, "text": "a"}, {"seed": 5, "text": "new"}]))
+    index, filenames = _index()
+    assert "2023B_page1.png" in filenames
+    assert np.allclose(index.reconstruct(filenames.index("2023B_page1.png")), shared_vector)
+    assert get_aliases() == {}
+    assert _search("2023B") == ["2023B_page1.png", "2023B_page2.png"]
+    assert _search("2022A") == ["2022A_page1.png", "2022A_page2.png"]
+
+    deduper = PageDeduper()
+    assert set(deduper.hashes) == set(filenames)
+
+
+def test_reingested_page_aliases_the_promoted_representative(fake_pdfs):
+    co = FakeCohere()
+    process_pdfs_and_embed_pages(co, fake_pdfs("2022A", [{"seed": 1, "text": "a"}, {"seed": 2, "text": "b"}]))
+    process_pdfs_and_embed_pages(co, fake_pdfs("2023B", [{"seed": 2, "text": "b"}, {"seed": 9, "text": "c"}]))
+    process_pdfs_and_embed_pages(co, fake_pdfs("2024C", [{"seed": 2, "text": "b"}]))
+    assert get_aliases() == {"2023B_page1.png": "2022A_page2.png", "2024C_page1.png": "2022A_page2.png"}
+
+    # Same pages, new text: the shared page is removed, then comes back as a duplicate
+    process_pdfs_and_embed_pages(co, fake_pdfs("2022A", [{"seed": 1, "text": "a2"}, {"seed": 2, "text": "b2"}]))
+    _, filenames = _index()
+    aliases = get_aliases()
+    assert aliases == {"2022A_page2.png": "2023B_page1.png", "2024C_page1.png": "2023B_page1.png"}
+    assert all(representative in filenames for representative in aliases.values())
+    assert not set(aliases) & set(filenames)
+    assert _search("2022A") == ["2022A_page1.png", "2022A_page2.png"]
+    assert _search("2024C") == ["2024C_page1.png"]
@@ -0,0 +1,143 @@
+import time
+import threading
+import pytest
+import resilience
+from resilience import Endpoint, CircuitBreaker, CircuitOpenError
+from fake_clients import FakeAPIError, FakeCohere
+
+
+class FlakyServer:
+    """Answers "ok" after failing its first calls with the given errors."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retries_server_errors_then_succeeds():
+    server = FlakyServer(FakeAPIError(503), FakeAPIError(500))
+    endpoint = Endpoint("test", retries=3, base_delay=0.01)
+    assert endpoint.call(server) == "ok"
+    assert server.calls == 3
+    assert endpoint.stats()["retries"] == 2
+    assert endpoint.stats()["state"] == "closed"
+
+
+def test_client_errors_are_not_retried():
+    server = FlakyServer(FakeAPIError(400))
+    endpoint = Endpoint("test", retries=3, base_delay=0.01)
+    with pytest.raises(FakeAPIError):
+        endpoint.call(server)
+    assert server.calls == 1
+
+
+def test_gives_up_after_the_last_retry():
+    server = FlakyServer(*[FakeAPIError(503)] * 5)
+    endpoint = Endpoint("test", retries=2, base_delay=0.01, breaker=CircuitBreaker(failures=10))
+    with pytest.raises(FakeAPIError):
+        endpoint.call(server)
+    assert server.calls == 3
+
+
+def test_backoff_is_full_jitter_capped_at_max_delay():
+    endpoint = Endpoint("test", base_delay=1.0, max_delay=4.0)
+    delays = [endpoint.backoff(attempt) for attempt in range(6) for _ in range(50)]
+    assert min(delays) >= 0 and max(delays) <= 4.0
+    assert all(endpoint.backoff(0) <= 1.0 for _ in range(50))
+
+
+def test_retry_after_pauses_the_whole_endpoint():
+    server = FlakyServer(FakeAPIError(429, retry_after=0.3))
+    endpoint = Endpoint("test", rpm=6000, retries=2, base_delay=0.0)
+    start = time.monotonic()
+    assert endpoint.call(server) == "ok"
+    assert time.monotonic() - start >= 0.3
+
+    # A 429 for one caller holds back the others until the requested time has passed
+    endpoint.limiter.pause(0.3)
+    start = time.monotonic()
+    other = threading.Thread(target=endpoint.call, args=(FlakyServer(),))
+    other.start()
+    other.join()
+    assert time.monotonic() - start >= 0.25
+
+
+def test_breaker_opens_fails_fast_and_recovers_through_a_probe():
+    server = FlakyServer(FakeAPIError(503), FakeAPIError(503))
+    endpoint = Endpoint("test", retries=0, breaker=CircuitBreaker(failures=2, reset_after=0.2))
+    for _ in range(2):
+        with pytest.raises(FakeAPIError):
+            endpoint.call(server)
+    assert endpoint.stats()["state"] == "open"
+
+    with pytest.raises(CircuitOpenError):
+        endpoint.call(server)
+    assert server.calls == 2  # rejected without reaching the server
+
+    time.sleep(0.25)
+    assert endpoint.call(server) == "ok"  # the half-open probe succeeds
+    assert endpoint.stats()["state"] == "closed"
+
+
+def test_slow_idempotent_call_is_hedged(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY", 0.05)
+    endpoint = Endpoint("test", hedge=True)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        endpoint.call(lambda: "fast", idempotent=True)
+
+    calls = []
+
+    def first_call_stalls():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(1.0)
+            return "slow"
+        return "hedged"
+
+    start = time.monotonic()
+    assert endpoint.call(first_call_stalls, idempotent=True) == "hedged"
+    assert time.monotonic() - start < 0.5
+    assert endpoint.stats()["hedges"] == 1
+
+
+def test_no_hedge_when_the_pool_is_full(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(resilience, "_hedge_slots", threading.BoundedSemaphore(1))
+    endpoint = Endpoint("test", hedge=True)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        endpoint.call(lambda: "fast", idempotent=True)
+
+    resilience._hedge_slots.acquire()  # every pool thread is busy
+    threads = []
+
+    def slow():
+        threads.append(threading.current_thread())
+        time.sleep(0.2)
+        return "slow"
+
+    assert endpoint.call(slow, idempotent=True) == "slow"
+    assert threads == [threading.current_thread()]  # ran on the caller's thread, not queued
+    assert endpoint.stats()["hedges"] == 0
+
+
+def test_fake_cohere_outages_are_retried():
+    co = FakeCohere(error_rate=0.5, seed=3)
+    endpoint = Endpoint("test", retries=8, base_delay=0.001, breaker=CircuitBreaker(failures=100))
+    for _ in range(10):
+        response = endpoint.call(co.embed, idempotent=True, texts=["question"])
+        assert len(response.embeddings.float) == 1
+    assert co.calls > 10
+    assert endpoint.stats()["retries"] == co.calls - 10
+
+
+def test_retry_decorator():
+    from utils import retry
+    server = FlakyServer(FakeAPIError(503), ConnectionError("reset"))
+    assert retry(retries=2, backoff=0.01)(server)() == "ok"
+    assert server.calls == 3
@@ -0,0 +1,27 @@
+import vision_query
+from fake_clients import FakeOpenAI
+
+PAGES = ["images/2022AnnualReport_page3.png"]
+
+
+def test_answer_streams_in_chunk_order(legacy_store):
+    llm = FakeOpenAI(answer="The fund disbursed 12 million dollars in 2022.", chunks=5)
+    chunks = list(vision_query.stream_answer_about_images("How much?", PAGES, llm, verbose=False))
+    assert len(chunks) > 1
+    assert "".join(chunks) == llm.answer
+
+
+def test_streamed_answer_is_cached_and_replayed_whole(legacy_store):
+    _, vectors = legacy_store
+    llm = FakeOpenAI(chunks=5)
+    stream = vision_query.stream_answer_about_images
+    streamed = list(stream("How much?", PAGES, llm, verbose=False, query_embedding=vectors[0]))
+    replayed = list(stream("How much?", PAGES, llm, verbose=False, query_embedding=vectors[0]))
+    assert replayed == ["".join(streamed).strip()]
+    assert llm.calls == 1
+
+
+def test_failed_stream_yields_an_error_message(legacy_store):
+    llm = FakeOpenAI(error_rate=1.0, error_status=400)
+    chunks = list(vision_query.stream_answer_about_images("How much?", PAGES, llm, verbose=False))
+    assert chunks == ["Error occurred during processing."]
@@ -0,0 +1,71 @@
+import math
+import pytest
+from config import BM25_K1, BM25_B, RRF_K
+from text_index import tokenize, write_pdf, TextIndex, fuse_rankings
+
+CORPUS = {
+    "2021Fund": ["grants to health programs", "health health health grants", "audit opinion"],
+    "2022Fund": ["the fund disbursed 1,250 million for health", "climate grants and climate loans"],
+}
+
+
+@pytest.fixture
+def text_index(workdir):
+    for pdf_name, pages in CORPUS.items():
+        write_pdf(pdf_name, pages)
+    return TextIndex()
+
+
+def test_tokenize_drops_thousands_separators():
+    assert tokenize("Spent $1,250.5 million in FY2023 (IDA-19)") == \
+        ["spent", "1250.5", "million", "in", "fy2023", "ida", "19"]
+    assert tokenize("1,250") == tokenize("1250") == ["1250"]
+
+
+def test_bm25_scores_and_ranking(text_index):
+    pages = [tokenize(text) for texts in CORPUS.values() for text in texts]
+    avg_length = sum(map(len, pages)) / len(pages)
+
+    def bm25(page, terms):
+        score = 0.0
+        for term in terms:
+            df = sum(term in p for p in pages)
+            tf = page.count(term)
+            if tf:
+                idf = math.log(1 + (len(pages) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * len(page) / avg_length))
+        return score
+
+    hits = text_index.search("health grants", 10)
+    assert [name for name, _ in hits] == ["2021Fund_page2.png", "2021Fund_page1.png",
+                                          "2022Fund_page2.png", "2022Fund_page1.png"]
+    names = [f"{pdf}_page{i + 1}.png" for pdf, texts in CORPUS.items() for i in range(len(texts))]
+    for name, score in hits:
+        assert score == pytest.approx(bm25(pages[names.index(name)], ["health", "grants"]), rel=1e-5)
+    assert text_index.search("health grants", 2) == hits[:2]
+
+
+def test_numbers_match_with_or_without_separators(text_index):
+    assert [name for name, _ in text_index.search("1250 million", 5)] == ["2022Fund_page1.png"]
+    assert text_index.search("nothing here", 5) == []
+
+
+def test_filtered_text_search(text_index):
+    assert [name for name, _ in text_index.search("grants", 10, {"years": [2022]})] == ["2022Fund_page2.png"]
+    assert [name for name, _ in text_index.search("health grants", 10, {"documents": ["2021Fund"],
+                                                                         "pages": [2, 3]})] == ["2021Fund_page2.png"]
+
+
+def test_rrf_fusion_order():
+    fused = fuse_rankings([["a", "b", "c"], ["c", "d"]], top_k=3)
+    assert [name for name, _ in fused] == ["c", "a", "b"]
+    assert fused[0][1] == pytest.approx(1 / (RRF_K + 3) + 1 / (RRF_K + 1))
+
+
+def test_page_found_only_by_text_comes_out_of_the_fused_ranking(text_index):
+    from vision_query import _rank_pages
+    vector_hits = [("2021Fund_page3.png", 0.41), ("2021Fund_page1.png", 0.40), ("2022Fund_page1.png", 0.39)]
+    ranked = _rank_pages("climate loans", vector_hits, 3, text_index)
+    assert "2022Fund_page2.png" not in dict(vector_hits)
+    # Both first-ranked pages score 1 / (RRF_K + 1); ties keep the vector ranking first
+    assert [name for name, _ in ranked] == ["2021Fund_page3.png", "2022Fund_page2.png", "2021Fund_page1.png"]
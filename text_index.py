@@ -0,0 +1,179 @@
+"""
+Local lexical index over the text of every page, for hybrid retrieval.
+
+    python text_index.py build          # extract text for every PDF in source_docs/
+    python text_index.py search "IDA19 replenishment"
+
+Ingestion extracts each PDF's page text with poppler's pdftotext and writes one compact
+segment per PDF (sorted term list plus uint32 postings in an .npz), so re-ingesting a PDF
+rewrites only its own segment. Queries are scored with BM25 against an in-memory merge of
+the segments, reloaded when the segment folder changes, and fused with the vector ranking
+by reciprocal rank fusion.
+"""
+import re
+import sys
+import math
+import subprocess
+import threading
+import functools
+import numpy as np
+from pathlib import Path
+from collections import Counter
+from tracing import traced
+from utils import atomic_write
+from page_meta import build_page_meta, match_rows
+from config import TEXT_INDEX_FOLDER, PDF_FOLDER, BM25_K1, BM25_B, RRF_K
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+
+
+def tokenize(text: str) -> list:
+    """Lowercased words and numbers; thousands separators are dropped so "1,250" matches "1250"."""
+    tokens = []
+    for token in _TOKEN.findall(text.casefold()):
+        if token[0].isdigit():
+            token = token.replace(",", "")
+        tokens.append(token)
+    return tokens
+
+
+def extract_page_texts(pdf_path) -> list:
+    """Text of each page, in page order, from a single pdftotext run."""
+    result = subprocess.run(["pdftotext", "-enc", "UTF-8", str(pdf_path), "-"],
+                            capture_output=True, check=True)
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    return pages[:-1] if pages and not pages[-1].strip() else pages
+
+
+def _segment_path(pdf_name: str) -> Path:
+    return TEXT_INDEX_FOLDER / f"{pdf_name}.npz"
+
+
+def write_pdf(pdf_name: str, page_texts: list):
+    """Replaces the segment of one PDF; page i is stored as `{pdf_name}_page{i + 1}.png`."""
+    counts = [Counter(tokenize(text)) for text in page_texts]
+    terms = sorted(set().union(*counts)) if counts else []
+    term_ids = {term: i for i, term in enumerate(terms)}
+
+    postings = sorted((term_ids[term], page, tf) for page, c in enumerate(counts) for term, tf in c.items())
+    postings = np.array(postings, dtype="uint32").reshape(-1, 3)
+    offsets = np.searchsorted(postings[:, 0], np.arange(len(terms) + 1)).astype("uint32")
+
+    TEXT_INDEX_FOLDER.mkdir(parents=True, exist_ok=True)
+    with atomic_write(_segment_path(pdf_name)) as f:
+        np.savez_compressed(
+            f,
+            terms=np.array(terms, dtype="U"),
+            offsets=offsets,
+            pages=postings[:, 1],
+            tfs=postings[:, 2],
+            lengths=np.array([sum(c.values()) for c in counts], dtype="uint32"),
+            names=np.array([f"{pdf_name}_page{i + 1}.png" for i in range(len(page_texts))], dtype="U"),
+        )
+
+
+def index_pdf(pdf_path):
+    pdf_path = Path(pdf_path)
+    write_pdf(pdf_path.stem, extract_page_texts(pdf_path))
+
+
+class TextIndex:
+    """BM25 over the merged segments: term -> (page ids, term frequencies)."""
+
+    def __init__(self, folder: Path = TEXT_INDEX_FOLDER):
+        self.names = []
+        postings = {}
+        lengths = []
+        for path in sorted(Path(folder).glob("*.npz")):
+            with np.load(path) as segment:
+                base = len(self.names)
+                self.names += segment["names"].tolist()
+                lengths.append(segment["lengths"])
+                offsets, pages, tfs = segment["offsets"], segment["pages"], segment["tfs"]
+                for i, term in enumerate(segment["terms"].tolist()):
+                    lo, hi = offsets[i], offsets[i + 1]
+                    postings.setdefault(term, []).append((pages[lo:hi] + base, tfs[lo:hi]))
+
+        self.lengths = np.concatenate(lengths).astype("float32") if lengths else np.empty(0, "float32")
+        avg_length = self.lengths.mean() if len(self.lengths) else 1.0
+        # Per-page BM25 length normalization, precomputed once
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(avg_length, 1e-9))
+        self.postings = {}
+        for term, parts in postings.items():
+            ids = np.concatenate([p for p, _ in parts]).astype("int64")
+            tfs = np.concatenate([t for _, t in parts]).astype("float32")
+            df = len(ids)
+            idf = math.log(1 + (len(self.names) - df + 0.5) / (df + 0.5))
+            self.postings[term] = (ids, tfs, idf)
+
+    def __len__(self):
+        return len(self.names)
+
+    @functools.cached_property
+    def meta(self) -> dict:
+        """Document, year and page of each indexed page, for filtered searches."""
+        return build_page_meta(self.names, default_time=0.0)
+
+    @traced("bm25_search")
+    def search(self, question: str, top_k: int, filters: dict = None) -> list:
+        """[(page name, BM25 score)] for the best `top_k` pages containing any query term."""
+        hits = [self.postings[t] for t in set(tokenize(question)) if t in self.postings]
+        if not hits:
+            return []
+        scores = np.zeros(len(self.names), dtype="float32")
+        for ids, tfs, idf in hits:
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + self._norm[ids])
+        if filters:
+            scores[~match_rows(self.meta, filters)] = 0
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.names[i], float(scores[i])) for i in matched]
+
+
+_lock = threading.Lock()
+_cached = None  # (folder signature, TextIndex)
+
+
+def _signature():
+    try:
+        # Segments are renamed into place, which updates the folder's mtime
+        return TEXT_INDEX_FOLDER.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_text_index() -> TextIndex:
+    """Process-wide merged index, rebuilt when a segment is added or replaced."""
+    global _cached
+    signature = _signature()
+    cached = _cached
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _lock:
+        if _cached is None or _cached[0] != signature:
+            _cached = (signature, TextIndex())
+        return _cached[1]
+
+
+def fuse_rankings(rankings: list, top_k: int, k: int = RRF_K) -> list:
+    """Reciprocal rank fusion: [(name, score)] ordered by sum of 1 / (k + rank) over the rankings."""
+    scores = {}
+    for ranking in rankings:
+        for rank, name in enumerate(ranking, start=1):
+            scores[name] = scores.get(name, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["build"]:
+        for pdf_path in sorted(Path(PDF_FOLDER).glob("*.pdf")):
+            index_pdf(pdf_path)
+            print(f"📝 Indexed text of {pdf_path.name}")
+    elif sys.argv[1:2] == ["search"] and len(sys.argv) > 2:
+        for name, score in get_text_index().search(" ".join(sys.argv[2:]), 10):
+            print(f"{score:7.3f}  {name}")
+    else:
+        print(__doc__)
@@ -0,0 +1,117 @@
+"""
+Tile mode: overlapping crops of every page embedded into their own index.
+
+    TILE_MODE=1 python tiles.py   # backfill tiles for pages already in the page index
+
+The tile index lives in TILE_STORE_FOLDER and is published in generations exactly like
+the page index; TILE_META_PATH maps each tile to its page and its bounding box (fractions
+of the page). At query time the pages of the best tiles join the page ranking, and a
+matched page is sent to the LLM as its best crop rather than the whole page.
+"""
+import json
+import numpy as np
+from pathlib import Path
+from utils import atomic_write
+from page_meta import match_rows
+from image_prep import make_tiles, page_of_tile
+from config import TILE_STORE_FOLDER, TILE_FOLDER, TILE_META_PATH, IMG_FOLDER
+
+
+def load_tile_meta() -> dict:
+    """{tile name: {"page", "bbox"}}"""
+    if TILE_META_PATH.exists():
+        with open(TILE_META_PATH, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def tiles_of_pages(page_names) -> list:
+    page_names = {Path(p).name for p in page_names}
+    return [tile for tile, meta in load_tile_meta().items() if meta["page"] in page_names]
+
+
+def _update_tile_meta(pdf_name: str, entries: dict):
+    meta = {tile: m for tile, m in load_tile_meta().items() if not tile.startswith(f"{pdf_name}_page")}
+    meta.update(entries)
+    TILE_META_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_write(TILE_META_PATH, "w") as f:
+        json.dump(meta, f)
+
+
+def embed_pdf_tiles(co, pdf_name: str, page_paths: list, cache=None) -> int:
+    """Replaces a PDF's tiles in the tile index and publishes a new tile generation."""
+    from embed_scheduler import embed_pages
+    from faiss_utils import load_faiss_index, save_faiss_index, add_embedding, remove_embeddings
+
+    index, names = load_faiss_index(TILE_STORE_FOLDER)
+    remove_embeddings(index, names, [n for n in names if n.startswith(f"{pdf_name}_page")])
+
+    entries = {}
+
+    def tiles():
+        for page_path in page_paths:
+            for tile_path, bbox in make_tiles(page_path):
+                entries[Path(tile_path).name] = {"page": Path(page_path).name, "bbox": bbox}
+                yield tile_path
+
+    added = 0
+    for tile_path, emb in embed_pages(co, tiles(), cache=cache):
+        add_embedding(index, names, emb, Path(tile_path).name)
+        added += 1
+    if cache is not None:
+        cache.flush()
+
+    # Metadata first: it only ever gains entries for tiles the published index may contain
+    _update_tile_meta(pdf_name, entries)
+    save_faiss_index(index, names, TILE_STORE_FOLDER, refreshed=[pdf_name])
+    return added
+
+
+def search_tiles(queries, depth: int, filters: dict = None):
+    """Per query, [(tile name, score)] best first; None while the tile index is empty."""
+    from faiss_utils import get_faiss_index, search_index, search_subset, page_meta_for
+    index, names = get_faiss_index(TILE_STORE_FOLDER)
+    if not index.ntotal:
+        return None
+    if filters:
+        ids = np.flatnonzero(match_rows(page_meta_for(index), filters))
+        if not len(ids):
+            return [[] for _ in np.atleast_2d(queries)]
+        D, I = search_subset(index, queries, depth, ids)
+    else:
+        D, I = search_index(index, queries, depth)
+    return [[(names[i], float(s)) for s, i in zip(scores, ids) if 0 <= i < len(names)]
+            for scores, ids in zip(D, I)]
+
+
+def tile_page_ranking(tile_hits: list) -> list:
+    """Pages in the order of their best tile."""
+    return list(dict.fromkeys(page_of_tile(name) for name, _ in tile_hits))
+
+
+def crop_paths(page_names: list, tile_hits: list) -> list:
+    """Path to send for each page: its best-matching crop if a tile of it matched, else the page."""
+    best = {}
+    for name, _ in tile_hits or []:
+        best.setdefault(page_of_tile(name), name)
+    return [str(TILE_FOLDER / best[page]) if page in best else str(IMG_FOLDER / page)
+            for page in page_names]
+
+
+if __name__ == "__main__":
+    # Backfill the tile index for pages ingested before tile mode was enabled
+    from collections import defaultdict
+    from config import get_cohere_client, INGEST_LOCK_PATH
+    from utils import file_lock
+    from faiss_utils import load_filenames
+    from embedding_cache import EmbeddingCache
+
+    cache = EmbeddingCache()
+    # Tile generations are published like the worker's: one ingestion at a time
+    with file_lock(INGEST_LOCK_PATH):
+        by_pdf = defaultdict(list)
+        for name in load_filenames():
+            if (IMG_FOLDER / name).exists():
+                by_pdf[name.rsplit("_page", 1)[0]].append(str(IMG_FOLDER / name))
+        for pdf_name, page_paths in sorted(by_pdf.items()):
+            print(f"🧩 Embedded {embed_pdf_tiles(get_cohere_client(), pdf_name, page_paths, cache)} tiles of {pdf_name}")
@@ -0,0 +1,93 @@
+"""
+Lightweight per-stage latency tracing.
+
+    with span("faiss_search"):
+        ...
+
+    @traced("embed")
+    def embed_images(...): ...
+
+Durations are kept per stage in a bounded window for p50/p95/p99, exposed as
+Prometheus text by render_prometheus(), and optionally appended to TRACE_JSONL_PATH.
+"""
+import json
+import time
+import inspect
+import threading
+import functools
+import numpy as np
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from config import TRACE_JSONL_PATH, TRACE_MAX_SAMPLES
+
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=TRACE_MAX_SAMPLES))
+_counts = defaultdict(int)
+_sums = defaultdict(float)
+
+
+def record(stage: str, seconds: float, **attrs):
+    with _lock:
+        _samples[stage].append(seconds)
+        _counts[stage] += 1
+        _sums[stage] += seconds
+        if TRACE_JSONL_PATH:
+            with open(TRACE_JSONL_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"ts": time.time(), "stage": stage, "seconds": seconds, **attrs}) + "\n")
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, **attrs)
+
+
+def traced(stage: str):
+    """Decorator form of span(); for generator functions the span covers the whole iteration."""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                with span(stage):
+                    yield from fn(*args, **kwargs)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summary() -> dict:
+    """{stage: {"count", "mean", "p50", "p95", "p99"}} in seconds, over the recent window."""
+    with _lock:
+        snapshot = {stage: (np.array(samples), _counts[stage], _sums[stage])
+                    for stage, samples in _samples.items() if samples}
+    result = {}
+    for stage, (samples, count, total) in sorted(snapshot.items()):
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        result[stage] = {"count": count, "mean": total / count, "p50": p50, "p95": p95, "p99": p99}
+    return result
+
+
+def render_prometheus() -> str:
+    lines = ["# HELP rag_stage_seconds Latency of each pipeline stage.",
+             "# TYPE rag_stage_seconds summary"]
+    for stage, stats in summary().items():
+        for quantile in ("p50", "p95", "p99"):
+            lines.append(f'rag_stage_seconds{{stage="{stage}",quantile="0.{quantile[1:]}"}} {stats[quantile]:.6f}')
+        lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {stats["mean"] * stats["count"]:.6f}')
+        lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _counts.clear()
+        _sums.clear()
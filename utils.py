@@ -4,13 +4,24 @@ import json
 import base64
 import hashlib
 import numpy as np
-from tqdm import tqdm
 from pathlib import Path
 import mimetypes
-from config import MODEL_NAME
-from pdf2image import convert_from_path
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from config import (MODEL_NAME, EMBED_DIM, RASTER_DPI, RASTER_CHUNK_PAGES, RASTER_MAX_WORKERS,
+                    EMBED_TOKENS_PER_IMAGE, RETRY_ATTEMPTS, RETRY_BASE_DELAY)
+from image_prep import prepare_image, make_thumbnail
+from tracing import traced, record
+from resilience import Endpoint, resilient, embed_endpoint
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # ==== HELPERS ====
+@traced("hash_pdf")
 def hash_file(filepath: str) -> str:
     sha256 = hashlib.sha256()
     with open(filepath, "rb") as f:
@@ -19,8 +30,10 @@ def hash_file(filepath: str) -> str:
     return sha256.hexdigest()
 
 
+@traced("base64_encode")
 def base64_from_image(img_path: str) -> str:
-    img_path = Path(img_path)
+    # Upload the size-bounded derivative rather than the full 200-DPI page
+    img_path = Path(prepare_image(img_path))
     with img_path.open("rb") as f:
         b64_data = base64.b64encode(f.read()).decode("utf-8")
     mime_type, _ = mimetypes.guess_type(img_path.name)
@@ -30,33 +43,137 @@ def base64_from_image(img_path: str) -> str:
 
 
 def embed_image(co, img_path: str):
-    api_input_document = {
-        "content": [{"type": "image", "image": base64_from_image(img_path)}]
-    }
-    api_response = co.embed(
+    return embed_images(co, [img_path])[0]
+
+
+@traced("embed")
+def embed_images(co, img_paths: list) -> list:
+    """Embeds several page images with a single co.embed call, preserving input order."""
+    api_input_documents = [
+        {"content": [{"type": "image", "image": base64_from_image(img_path)}]}
+        for img_path in img_paths
+    ]
+    api_response = embed_endpoint.call(
+        co.embed,
+        tokens=len(img_paths) * EMBED_TOKENS_PER_IMAGE,
+        idempotent=True,
         model=MODEL_NAME,
         input_type="search_document",
         embedding_types=["float"],
-        inputs=[api_input_document],
+        output_dimension=EMBED_DIM,
+        inputs=api_input_documents,
     )
-    return np.asarray(api_response.embeddings.float[0])
+    return [np.asarray(emb) for emb in api_response.embeddings.float]
 
 
-def convert_pdf_to_images(pdf_path: str, output_dir: str) -> list:
+def _render_page_range(pdf_path: str, output_dir: str, first_page: int, last_page: int, dpi: int) -> tuple:
+    # Runs in a worker process; only `last_page - first_page + 1` pages are ever held in memory.
+    # Returns the page paths and the worker's peak RSS (its pool lives for this one PDF).
+    from pdf2image import convert_from_path
+    pdf_name = Path(pdf_path).stem
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    image_paths = []
+
+    for page_number, img in enumerate(images, start=first_page):
+        img_filename = Path(output_dir) / f"{pdf_name}_page{page_number}.png"
+        img.save(img_filename, "PNG")
+        img.close()
+        prepare_image(img_filename)
+        make_thumbnail(img_filename)
+        image_paths.append(str(img_filename))
+
+    return image_paths, _peak_rss_mb()
+
+
+def _peak_rss_mb() -> float:
+    """High-water RSS of this process or its largest waited-for child (pdftoppm), in MB."""
+    if resource is None:
+        return float("nan")
+    # ru_maxrss is reported in KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def iter_pdf_pages(pdf_path: str, output_dir: str, dpi: int = RASTER_DPI,
+                   chunk_size: int = RASTER_CHUNK_PAGES, max_workers: int = RASTER_MAX_WORKERS):
+    """
+    Renders a PDF in page-range chunks across a process pool and yields each page
+    path, in page order, as soon as its chunk is written to disk.
+    """
+    from pdf2image import pdfinfo_from_path
     pdf_path = Path(pdf_path)
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    pdf_name = pdf_path.stem
-    images = convert_from_path(str(pdf_path), dpi=200)
-    image_paths = []
+    start = time.perf_counter()
+    page_count = pdfinfo_from_path(str(pdf_path))["Pages"]
+    ranges = [(first, min(first + chunk_size - 1, page_count))
+              for first in range(1, page_count + 1, chunk_size)]
 
-    for i, img in enumerate(images):
-        img_filename = output_dir / f"{pdf_name}_page{i + 1}.png"
-        img.save(img_filename, "PNG")
-        image_paths.append(str(img_filename))
+    worker_peaks_mb = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_render_page_range, str(pdf_path), str(output_dir), first, last, dpi)
+            for first, last in ranges
+        ]
+        for future in futures:
+            image_paths, peak_mb = future.result()
+            worker_peaks_mb.append(peak_mb)
+            yield from image_paths
+
+    elapsed = time.perf_counter() - start
+    record("rasterize", elapsed, pdf=pdf_path.name, pages=page_count)
+    print(f"🖨️ Rasterized {page_count} pages of {pdf_path.name} in {elapsed:.1f}s "
+          f"(peak worker RSS {max(worker_peaks_mb, default=float('nan')):.0f} MB)")
 
-    return image_paths
+
+def convert_pdf_to_images(pdf_path: str, output_dir: str) -> list:
+    return list(iter_pdf_pages(pdf_path, output_dir))
+
+
+@contextmanager
+def atomic_write(path, mode: str = "wb"):
+    """
+    Yields a temp file next to `path` and renames it over `path` once written and
+    fsynced, so readers see either the old file or the complete new one.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def fsync_dir(path):
+    """Makes renames inside `path` durable (no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on `path`, held by one process (or thread) at a time."""
+    import fcntl
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
 
 
 def load_json(path: str) -> dict:
@@ -67,21 +184,10 @@ def load_json(path: str) -> dict:
 
 
 def save_json(path: str, data: dict):
-    with open(path, "w") as f:
+    with atomic_write(path, "w") as f:
         json.dump(data, f, indent=2)
 
 
-def retry(retries=3, backoff=2):
-    def decorator(fn):
-        def wrapper(*args, **kwargs):
-            delay = backoff
-            for attempt in range(retries):
-                try:
-                    return fn(*args, **kwargs)
-                except Exception as e:
-                    print(f"Attempt {attempt + 1} failed — retrying in {delay}s: {e}")
-                    time.sleep(delay)
-                    delay *= 2
-            raise RuntimeError("All retries failed")
-        return wrapper
-    return decorator
\ No newline at end of file
+def retry(retries=RETRY_ATTEMPTS, backoff=RETRY_BASE_DELAY):
+    """Full-jitter retries for a one-off call; remote APIs use the shared endpoints in resilience.py."""
+    return resilient(Endpoint("retry", retries=retries, base_delay=backoff))
@@ -1,29 +1,133 @@
 import os
+import time
 import base64
 import numpy as np
-from PIL import Image
-from pathlib import Path
-from openai import OpenAI
-from utils import embed_image
-from faiss_utils import load_faiss_index, normalize
-
-def search_image_by_question(question, co, top_k=4):
-    # Embed the question correctly
-    response = co.embed(
-        texts=[question],
-        input_type="search_query",
-        model="embed-v4.0"
-    )
-    query_emb = response.embeddings.float[0]  # ✅ Correct access
-
-    index, filenames = load_faiss_index()
+from utils import embed_image, base64_from_image
+from itertools import islice
+from config import QUERY_BATCH_SIZE, HYBRID_SEARCH, HYBRID_CANDIDATES, TILE_MODE
+from embeddings import get_query_embedding, get_query_embeddings
+from answer_cache import AnswerCache
+from text_index import get_text_index, fuse_rankings
+from tiles import search_tiles, tile_page_ranking, crop_paths
+from page_dedup import get_aliases
+from page_meta import PageSelection
+from tracing import span, record
+from resilience import chat_endpoint
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+answer_cache = AnswerCache()
+
+
+def _text_index():
+    """The page-text index when hybrid search is on and some text has been indexed, else None."""
+    if not HYBRID_SEARCH:
+        return None
+    text_index = get_text_index()
+    return text_index if len(text_index) else None
+
+
+def _selection(index, filenames, filters: dict):
+    """The rows of the page index that `filters` selects, or None for an unfiltered search."""
+    if not filters:
+        return None
+    from faiss_utils import page_meta_for
+    return PageSelection(page_meta_for(index), filenames, filters, get_aliases())
+
+
+def _vector_hits(index, filenames, queries, depth: int, selection) -> list:
+    """Per query, [(filename, cosine score)] from the page index, within the selection if any."""
+    from faiss_utils import search_index, search_subset
+    if selection is None:
+        D, I = search_index(index, queries, depth)
+        return [[(filenames[i], float(s)) for s, i in zip(scores, ids) if 0 <= i < len(filenames)]
+                for scores, ids in zip(D, I)]
+    if not len(selection):
+        return [[] for _ in np.atleast_2d(queries)]
+    D, I = search_subset(index, queries, depth, selection.ids)
+    return [[(selection.name(i), float(s)) for s, i in zip(scores, ids) if i >= 0]
+            for scores, ids in zip(D, I)]
+
+
+def _rank_pages(question, vector_hits: list, top_k: int, text_index, tile_hits: list = None,
+                selection: PageSelection = None) -> list:
+    """
+    [(filename, score)]: cosine hits as they are, or fused by RRF with the BM25 page-text
+    ranking and the pages of the best tiles.
+    """
+    rankings = [[name for name, _ in vector_hits]]
+    if text_index is not None:
+        # Deduplicated pages are only in the vector index under their representative
+        aliases = get_aliases()
+        canonical = selection.canonical if selection is not None else lambda name: aliases.get(name, name)
+        hits = text_index.search(question, HYBRID_CANDIDATES, selection.filters if selection else None)
+        rankings.append(list(dict.fromkeys(canonical(name) for name, _ in hits)))
+    if tile_hits:
+        rankings.append(tile_page_ranking(tile_hits))
+    if len(rankings) == 1:
+        return vector_hits[:top_k]
+    return fuse_rankings(rankings, top_k)
+
+
+def _search_tiles(queries, filters: dict = None):
+    return search_tiles(queries, HYBRID_CANDIDATES, filters) if TILE_MODE else None
+
+
+def search_image_by_question(question, co, top_k=4, filters: dict = None):
+    """
+    Paths of the `top_k` pages (or crops) that best answer the question. `filters` restricts
+    the search to some reports, years or pages, e.g. {"years": [2023]} (see page_meta).
+    """
+    from faiss_utils import get_faiss_index, normalize  # defers faiss to the first search
+    # Embed the question (repeat questions come from the query cache)
+    query_emb = get_query_embedding(question, co)
+
+    index, filenames = get_faiss_index()
     norm_query = normalize(np.array(query_emb)).astype("float32")
-    
-    D, I = index.search(norm_query[np.newaxis, :], top_k)
-    matched_paths = [str(Path("images") / filenames[i]) for i in I[0] if i < len(filenames)]
+    selection = _selection(index, filenames, filters)
+    text_index = _text_index()
+    tile_hits = _search_tiles(norm_query, filters)
+
+    # With a text or tile index, a deeper vector ranking is fused with the others
+    depth = max(top_k, HYBRID_CANDIDATES) if text_index or tile_hits else top_k
+    vector_hits = _vector_hits(index, filenames, norm_query, depth, selection)[0]
+    tile_hits = tile_hits[0] if tile_hits else None
+    ranked = _rank_pages(question, vector_hits, top_k, text_index, tile_hits, selection)
+    # Matched tiles are sent as crops; other pages as whole pages
+    matched_paths = crop_paths([name for name, _ in ranked], tile_hits)
     print("📂 matched_paths:", matched_paths)
     return matched_paths
 
+
+def search_images_by_questions(questions, co, top_k=4, batch_size=QUERY_BATCH_SIZE, filters: dict = None):
+    """
+    Batch variant of search_image_by_question for evaluation runs. `questions` may be a
+    lazy iterable; each batch is embedded with one co.embed call and searched with one
+    matrix index.search. Yields {"question", "images", "scores"} per question, in order;
+    scores are cosine similarities, or RRF scores when fused with the page-text index.
+    """
+    from faiss_utils import get_faiss_index
+    index, filenames = get_faiss_index()
+    selection = _selection(index, filenames, filters)
+    text_index = _text_index()
+    depth = max(top_k, HYBRID_CANDIDATES) if text_index or TILE_MODE else top_k
+    iterator = iter(questions)
+    while batch := list(islice(iterator, batch_size)):
+        queries = np.stack(get_query_embeddings(batch, co, batch_size)).astype("float32")
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        hits = _vector_hits(index, filenames, queries, depth, selection)
+        tile_hits = _search_tiles(queries, filters) or [None] * len(batch)
+        for question, vector_hits, tiles in zip(batch, hits, tile_hits):
+            ranked = _rank_pages(question, vector_hits, top_k, text_index, tiles, selection)
+            yield {
+                "question": question,
+                "images": crop_paths([name for name, _ in ranked], tiles),
+                "scores": [s for _, s in ranked],
+            }
+
 def encode_image_to_base64(img_path: str) -> str:
     """Encodes an image to base64 for embedding in a prompt."""
     if not os.path.exists(img_path):
@@ -32,52 +136,126 @@ def encode_image_to_base64(img_path: str) -> str:
         return base64.b64encode(img_file.read()).decode("utf-8")
 
 
-def answer_question_about_images(question: str, matched_paths: list, client: OpenAI,
-                                 model="gpt-4.1-mini", verbose=True, context_cache: list = None) -> str:
-    """
-    Sends a multimodal prompt (text + multiple images + recent context) to the LLM and returns the answer.
-    """
-    try:
-        # Encode each image to base64 and build image_url blocks
-        image_contents = []
-        for img_path in matched_paths:
-            b64 = encode_image_to_base64(img_path)
-            image_contents.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}})
+def _build_context_text(context_cache: list = None) -> str:
+    context_text = ""
+    if context_cache:
+        for i, item in enumerate(context_cache[-4:]):
+            context_text += f"Previous Q{i+1}: {item['question']}\n"
+            context_text += f"Answer: {item['answer']}\n\n"
+    return context_text
 
-        # 🧠 Build context from previous Q&A
-        context_text = ""
-        if context_cache:
-            for i, item in enumerate(context_cache[-4:]):
-                context_text += f"Previous Q{i+1}: {item['question']}\n"
-                context_text += f"Answer: {item['answer']}\n\n"
-
-        # 📝 Build prompt with context + current question
-        prompt_text = f"""
+
+def _build_messages(question: str, matched_paths: list, context_text: str) -> list:
+    # Encode each image to base64 and build image_url blocks
+    image_contents = []
+    for img_path in matched_paths:
+        image_contents.append({"type": "image_url", "image_url": {"url": base64_from_image(img_path)}})
+
+    # 📝 Build prompt with context + current question
+    context_block = f"Recent context:\n{context_text}" if context_text else ""
+    prompt_text = f"""
 You are a helpful assistant answering questions about World Bank trust fund reports based on images and prior discussion.
 
-{f"Recent context:\n{context_text}" if context_text else ""}
+{context_block}
 Now answer this question: {question}
 """.strip()
 
-        # 👤 Build message content
-        message_content = [{"type": "text", "text": prompt_text}] + image_contents
+    # 👤 Build message content
+    message_content = [{"type": "text", "text": prompt_text}] + image_contents
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": message_content},
+    ]
 
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": message_content},
-            ],
-            max_tokens=1000,
-        )
+
+def answer_question_about_images(question: str, matched_paths: list, client: "OpenAI",
+                                 model="gpt-4.1-mini", verbose=True, context_cache: list = None,
+                                 query_embedding=None) -> str:
+    """
+    Sends a multimodal prompt (text + multiple images + recent context) to the LLM and returns the answer.
+    When `query_embedding` is given, a near-duplicate question over the same pages is
+    answered from the semantic answer cache instead.
+    """
+    try:
+        # 🧠 Build context from previous Q&A
+        context_text = _build_context_text(context_cache)
+
+        if query_embedding is not None:
+            cached = answer_cache.lookup(query_embedding, matched_paths, model, context_text)
+            if cached is not None:
+                if verbose:
+                    print("♻️ Cached LLM Response:", cached)
+                return cached
+
+        messages = _build_messages(question, matched_paths, context_text)
+        with span("llm_call", model=model):
+            response = chat_endpoint.call(
+                client.chat.completions.create,
+                model=model,
+                messages=messages,
+                max_tokens=1000,
+            )
 
         answer_text = response.choices[0].message.content.strip()
         if verbose:
             print("🧠 LLM Response:", answer_text)
 
+        if query_embedding is not None:
+            answer_cache.store(query_embedding, matched_paths, model, answer_text, context_text)
+
         return answer_text
 
     except Exception as e:
         print(f"❌ Error processing images or getting response: {e}")
         return "Error occurred during processing."
 
+
+def stream_answer_about_images(question: str, matched_paths: list, client: "OpenAI",
+                               model="gpt-4.1-mini", verbose=True, context_cache: list = None,
+                               query_embedding=None):
+    """
+    Streaming variant of answer_question_about_images: yields the answer text as the
+    LLM produces it. A cached answer is yielded in one piece.
+    """
+    parts = []
+    try:
+        context_text = _build_context_text(context_cache)
+
+        if query_embedding is not None:
+            cached = answer_cache.lookup(query_embedding, matched_paths, model, context_text)
+            if cached is not None:
+                if verbose:
+                    print("♻️ Cached LLM Response:", cached)
+                yield cached
+                return
+
+        messages = _build_messages(question, matched_paths, context_text)
+        start = time.perf_counter()
+        # Retries cover opening the stream; once tokens flow a failure ends the answer
+        stream = chat_endpoint.call(
+            client.chat.completions.create,
+            model=model,
+            messages=messages,
+            max_tokens=1000,
+            stream=True,
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not parts:
+                    record("llm_first_token", time.perf_counter() - start, model=model)
+                parts.append(delta)
+                yield delta
+        record("llm_call", time.perf_counter() - start, model=model)
+
+        answer_text = "".join(parts).strip()
+        if verbose:
+            print("🧠 LLM Response:", answer_text)
+
+        if query_embedding is not None and answer_text:
+            answer_cache.store(query_embedding, matched_paths, model, answer_text, context_text)
+
+    except Exception as e:
+        print(f"❌ Error processing images or getting response: {e}")
+        if not parts:
+            yield "Error occurred during processing."